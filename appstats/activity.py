@@ -0,0 +1,80 @@
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .cache import LRUCache
+
+
+class LastSeenTracker:
+    """Records when installs were last seen, coalescing the writes.
+
+    Each install is written at most once per APPSTATS_LAST_SEEN_INTERVAL
+    seconds per process, remembering up to APPSTATS_LAST_SEEN_CACHE_SIZE
+    recently written installs. Installs that are due are buffered and written
+    together in a single UPDATE once APPSTATS_LAST_SEEN_BATCH_SIZE of them
+    are waiting or the oldest has waited APPSTATS_LAST_SEEN_FLUSH_INTERVAL
+    seconds, whether or not more requests arrive, together with the
+    last_seen copy on each install's latest version. The active install
+    counts work at day resolution over a 60-day window, so the delay does
+    not change their results in practice.
+    """
+
+    def __init__(self):
+        self.interval = getattr(settings, "APPSTATS_LAST_SEEN_INTERVAL", 60 * 60)
+        self.batch_size = getattr(settings, "APPSTATS_LAST_SEEN_BATCH_SIZE", 100)
+        self.flush_interval = getattr(settings, "APPSTATS_LAST_SEEN_FLUSH_INTERVAL", 60)
+        self._written = LRUCache(getattr(settings, "APPSTATS_LAST_SEEN_CACHE_SIZE", 10000), self.interval)
+        self._pending = {}
+        self._pending_since = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def touch(self, install_id, date_updated=None):
+        """Record that an install reported, given when its row was last written if known."""
+        if date_updated is not None and (timezone.now() - date_updated).total_seconds() < self.interval:
+            self._written.set(install_id, True)
+            return
+        if self._written.get(install_id) is not None:
+            return
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+                self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+            self._pending[install_id] = True
+            due = len(self._pending) >= self.batch_size or time.monotonic() - self._pending_since >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        from .models import Install, InstalledVersion
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            timer, self._timer = self._timer, None
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
+        if not pending:
+            return 0
+        now = timezone.now()
+        Install.objects.filter(pk__in=pending).update(date_updated=now)
+        InstalledVersion.objects.filter(install__in=pending, latest=True).update(last_seen=now)
+        for install_id in pending:
+            self._written.set(install_id, True)
+        return len(pending)
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread has its own connection, which nothing else closes.
+            connection.close()
+
+
+last_seen = LastSeenTracker()
+atexit.register(last_seen.flush)
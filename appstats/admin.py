@@ -11,7 +11,7 @@ class AppAdmin(admin.ModelAdmin):
         return obj.installs.count()
 
     def active_installs(self, obj):
-        return obj.active_installs().count()
+        return obj.active_install_count()
 
 
 class MetricAdmin(admin.ModelAdmin):
@@ -0,0 +1,210 @@
+import array
+import datetime
+import json
+import mmap
+import os
+import shutil
+import sys
+import zlib
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+
+# Type codes of the fixed-width columns, as used by the array module. Values
+# are stored little-endian.
+INT64 = "q"
+INT32 = "i"
+FLOAT64 = "d"
+
+# Column types: fixed-width numbers, dictionary-encoded strings (INT32 codes
+# plus a JSON list of the distinct values) and zlib-compressed JSON values
+# (INT64 end offsets into the decompressed data). Number and code columns are
+# deliberately not compressed: they are memory-mapped, so a scan only reads
+# the pages it touches and needs no memory of its own. They take 4 or 8
+# bytes a row on disk as a result; archives that are kept rather than
+# queried are better compressed as a whole (e.g. tar and zstd).
+NUMBER = "number"
+STRING = "string"
+JSON = "json"
+
+
+def _check_code(code):
+    size = {INT64: 8, INT32: 4, FLOAT64: 8}[code]
+    if array.array(code).itemsize != size:
+        raise RuntimeError(f"Array type {code!r} is not {size} bytes on this platform.")
+
+
+class ColumnWriter:
+
+    def __init__(self, directory, name, kind, code=None):
+        self.directory = directory
+        self.name = name
+        self.kind = kind
+        self.code = INT32 if kind == STRING else INT64 if kind == JSON else code
+        _check_code(self.code)
+        self.file = open(directory / f"{name}.bin", "wb")
+        self.values = {}
+        self.data = zlib.compressobj() if kind == JSON else None
+        self.data_file = open(directory / f"{name}.json.z", "wb") if kind == JSON else None
+        self.offset = 0
+        self.buffer = array.array(self.code)
+
+    def append(self, value):
+        if self.kind == STRING:
+            value = self.values.setdefault(value, len(self.values))
+        elif self.kind == JSON:
+            data = json.dumps(value, separators=(",", ":")).encode()
+            self.data_file.write(self.data.compress(data))
+            self.offset += len(data)
+            value = self.offset
+        self.buffer.append(value)
+        if len(self.buffer) >= 8192:
+            self.flush()
+
+    def flush(self):
+        if sys.byteorder == "big":
+            self.buffer.byteswap()
+        self.buffer.tofile(self.file)
+        self.buffer = array.array(self.code)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        meta = {"kind": self.kind, "code": self.code}
+        if self.kind == STRING:
+            with open(self.directory / f"{self.name}.values.json", "w") as f:
+                json.dump(list(self.values), f)
+        elif self.kind == JSON:
+            self.data_file.write(self.data.flush())
+            self.data_file.close()
+        return meta
+
+
+class PartitionWriter:
+    """Writes the rows of one partition, column by column, into a new directory.
+
+    The directory is only moved into place by close(), so readers never see
+    a partly written partition and an export can simply be run again.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.tmp = path.with_name(f".{path.name}.tmp")
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.columns = [ColumnWriter(self.tmp, name, kind, code) for name, kind, code in columns]
+        self.rows = 0
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        self.rows += 1
+
+    def close(self):
+        meta = {"rows": self.rows, "columns": {x.name: x.close() for x in self.columns}}
+        with open(self.tmp / "meta.json", "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp, self.path)
+
+
+def partition_path(root, app_slug, kind, metric_name, day):
+    return Path(root) / app_slug / kind / quote(metric_name, safe="") / day.isoformat()
+
+
+class Partition:
+    """The archived rows of one metric on one day.
+
+    Number columns are memory-mapped rather than read, so scanning a column
+    only touches the pages it needs.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.day = datetime.date.fromisoformat(self.path.name)
+        self.metric = unquote(self.path.parent.name)
+        self.kind = self.path.parent.parent.name
+        self.app = self.path.parent.parent.parent.name
+        with open(self.path / "meta.json") as f:
+            meta = json.load(f)
+        self.rows = meta["rows"]
+        self.columns = meta["columns"]
+        self._maps = []
+
+    def __repr__(self):
+        return f"<Partition {self.app}/{self.kind}/{self.metric}/{self.day}: {self.rows} rows>"
+
+    def _numbers(self, name, code):
+        with open(self.path / f"{name}.bin", "rb") as f:
+            if sys.byteorder == "big":
+                values = array.array(code)
+                values.frombytes(f.read())
+                values.byteswap()
+                return values
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(buffer)
+        return memoryview(buffer).cast(code)
+
+    def column(self, name):
+        """Return the values of a column as a sequence with one item per row."""
+        meta = self.columns[name]
+        values = self._numbers(name, meta["code"])
+        if meta["kind"] == NUMBER:
+            return values
+        if meta["kind"] == STRING:
+            with open(self.path / f"{name}.values.json") as f:
+                distinct = json.load(f)
+            return [distinct[x] for x in values]
+        with open(self.path / f"{name}.json.z", "rb") as f:
+            data = zlib.decompress(f.read())
+        starts = [0, *values[:-1]]
+        return [json.loads(data[start:end]) for start, end in zip(starts, values)]
+
+    def to_dict(self):
+        """Return every column, keyed by name."""
+        return {name: self.column(name) for name in self.columns}
+
+    def close(self):
+        for buffer in self._maps:
+            try:
+                buffer.close()
+            except BufferError:
+                # A memoryview of it is still in use; it is closed when
+                # that is garbage collected.
+                pass
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Archive:
+    """Reads an archive written by `manage.py export_archive`.
+
+    The archive is a directory tree of app slug, kind ("gauges",
+    "gauge_summaries" or "events"), metric name and day, with one directory
+    of column files per partition. It only depends on the standard library, so it can be copied
+    anywhere and read without the database or Django.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def partitions(self, app=None, kind=None, metric=None, start=None, end=None):
+        """Yield the partitions matching the filters, with days between start and end inclusive."""
+        for path in sorted(self.root.glob("*/*/*/*")):
+            if path.name.startswith(".") or not (path / "meta.json").exists():
+                continue
+            day = datetime.date.fromisoformat(path.name)
+            if app is not None and path.parent.parent.parent.name != app:
+                continue
+            if kind is not None and path.parent.parent.name != kind:
+                continue
+            if metric is not None and unquote(path.parent.name) != metric:
+                continue
+            if (start is not None and day < start) or (end is not None and day > end):
+                continue
+            yield Partition(path)
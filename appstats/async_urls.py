@@ -0,0 +1,23 @@
+from django.urls import path
+
+from . import async_views
+
+
+urlpatterns = [
+    path("api/counters/<slug:app_name>/", async_views.register_counters),
+    path("api/gauges/<slug:app_name>/", async_views.register_gauges),
+    path("api/events/<slug:app_name>/", async_views.register_events),
+    path("api/batch/<slug:app_name>/", async_views.register_batch),
+
+    path("", async_views.home),
+    path("app/<slug:app_slug>/", async_views.app_home, name="appstats.app_home"),
+    path("app/<slug:app_slug>/counter/<str:counter_name>/", async_views.counter, name="appstats.counter"),
+    path("app/<slug:app_slug>/counter/<str:counter_name>/series/", async_views.counter_series, name="appstats.counter_series"),
+    path("app/<slug:app_slug>/counter/<str:counter_name>/export/", async_views.counter_export, name="appstats.counter_export"),
+    path("app/<slug:app_slug>/gauge/<str:gauge_name>/", async_views.gauge, name="appstats.gauge"),
+    path("app/<slug:app_slug>/gauge/<str:gauge_name>/series/", async_views.gauge_series, name="appstats.gauge_series"),
+    path("app/<slug:app_slug>/gauge/<str:gauge_name>/export/", async_views.gauge_export, name="appstats.gauge_export"),
+    path("app/<slug:app_slug>/event/<str:event_name>/", async_views.event, name="appstats.event"),
+    path("app/<slug:app_slug>/event/<str:event_name>/series/", async_views.event_series, name="appstats.event_series"),
+    path("app/<slug:app_slug>/event/<str:event_name>/export/", async_views.event_export, name="appstats.event_export"),
+]
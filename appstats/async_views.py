@@ -0,0 +1,178 @@
+"""Async versions of the ingest and dashboard views, for the ASGI deployment profile.
+
+Request bodies are read by the ASGI server before the view runs, so slow
+uploads only hold a coroutine. Validation and authentication (from
+app_cache) run on the event loop; only the database writes and template
+rendering, which need Django's synchronous transaction and template
+machinery, are handed to a thread.
+"""
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import render
+
+from .cache import app_cache
+from .models import App
+from .spool import get_spool
+from .streaming import ingest_ndjson, is_ndjson
+from .views import (
+    app_home_context, batch_results, counter_results, event_results, export_response, gauge_results, read_payload,
+    series_response,
+)
+
+
+def async_ingest_view(func):
+    """The async equivalent of require_POST and csrf_exempt, which are sync-only before Django 5.0."""
+
+    @functools.wraps(func)
+    async def inner(request, *args, **kwargs):
+        if request.method != "POST":
+            return HttpResponseNotAllowed(["POST"])
+        return await func(request, *args, **kwargs)
+
+    inner.csrf_exempt = True
+    return inner
+
+
+@sync_to_async
+def _ingest(app, data, format_results):
+    return format_results(app.ingest(data))
+
+
+async def _register(request, app_name, kind, success, queued, format_results):
+    if is_ndjson(request):
+        return await sync_to_async(ingest_ndjson)(request, app_name, kind)
+
+    data, error = read_payload(request, kind)
+    if error is not None:
+        return error
+
+    app = await app_cache.aauthenticate(app_name, request.GET.get("key"))
+    if app is None:
+        return JsonResponse({"error": "Invalid app and key."}, status=401)
+
+    spool = get_spool()
+    if spool is not None:
+        await sync_to_async(spool.append, thread_sensitive=False)(app.pk, data)
+        return JsonResponse({"success": queued}, status=202)
+
+    return JsonResponse({
+        "success": success,
+        "results": await _ingest(app, data, format_results),
+    })
+
+
+@async_ingest_view
+async def register_counters(request, app_name):
+    return await _register(request, app_name, "counters", "Counters updated.", "Counters queued.", counter_results)
+
+
+@async_ingest_view
+async def register_gauges(request, app_name):
+    return await _register(request, app_name, "gauges", "Gauges saved.", "Gauges queued.", gauge_results)
+
+
+@async_ingest_view
+async def register_events(request, app_name):
+    return await _register(request, app_name, "events", "Events saved.", "Events queued.", event_results)
+
+
+@async_ingest_view
+async def register_batch(request, app_name):
+    return await _register(request, app_name, "batch", "Metrics saved.", "Metrics queued.", batch_results)
+
+
+async def _get_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+
+
+async def home(request):
+    return await sync_to_async(render)(request, "appstats/home.html", {})
+
+
+async def app_home(request, app_slug):
+    app = await _get_or_404(App.objects.all(), slug=app_slug)
+    context = await sync_to_async(app_home_context)(app)
+    return await sync_to_async(render)(request, "appstats/app_home.html", context)
+
+
+async def counter(request, app_slug, counter_name):
+    app = await _get_or_404(App.objects.all(), slug=app_slug)
+    counter = await _get_or_404(app.counters.all(), name=counter_name)
+    return await sync_to_async(render)(request, "appstats/counter.html", {
+        "app": app,
+        "counter": counter,
+    })
+
+
+async def gauge(request, app_slug, gauge_name):
+    app = await _get_or_404(App.objects.all(), slug=app_slug)
+    gauge = await _get_or_404(app.gauges.all(), name=gauge_name)
+    return await sync_to_async(render)(request, "appstats/gauge.html", {
+        "app": app,
+        "gauge": gauge,
+    })
+
+
+async def event(request, app_slug, event_name):
+    app = await _get_or_404(App.objects.all(), slug=app_slug)
+    event = await _get_or_404(app.events.all(), name=event_name)
+    return await sync_to_async(render)(request, "appstats/event.html", {
+        "app": app,
+        "event": event,
+    })
+
+
+async def _series(request, app_slug, related_name, metric_name):
+    app = await _get_or_404(App.objects.all(), slug=app_slug)
+    metric = await _get_or_404(getattr(app, related_name).all(), name=metric_name)
+    return await sync_to_async(series_response)(request, metric)
+
+
+async def counter_series(request, app_slug, counter_name):
+    return await _series(request, app_slug, "counters", counter_name)
+
+
+async def gauge_series(request, app_slug, gauge_name):
+    return await _series(request, app_slug, "gauges", gauge_name)
+
+
+async def event_series(request, app_slug, event_name):
+    return await _series(request, app_slug, "events", event_name)
+
+
+async def _iterate_in_thread(iterator):
+    # Django would otherwise read a sync iterator to the end before sending
+    # any of it, so fetch one chunk at a time, always in the same thread.
+    done = object()
+    while True:
+        chunk = await sync_to_async(next)(iterator, done)
+        if chunk is done:
+            break
+        yield chunk
+
+
+async def _export(request, app_slug, related_name, metric_name):
+    app = await _get_or_404(App.objects.all(), slug=app_slug)
+    metric = await _get_or_404(getattr(app, related_name).all(), name=metric_name)
+    response = await sync_to_async(export_response)(request, app, metric)
+    if response.streaming:
+        response.streaming_content = _iterate_in_thread(iter(response.streaming_content))
+    return response
+
+
+async def counter_export(request, app_slug, counter_name):
+    return await _export(request, app_slug, "counters", counter_name)
+
+
+async def gauge_export(request, app_slug, gauge_name):
+    return await _export(request, app_slug, "gauges", gauge_name)
+
+
+async def event_export(request, app_slug, event_name):
+    return await _export(request, app_slug, "events", event_name)
@@ -0,0 +1,368 @@
+import contextvars
+import copy
+import functools
+import hashlib
+import hmac
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.dispatch import Signal
+
+
+# Cache backends that keep their entries in the process that wrote them.
+PER_PROCESS_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+class SharedFileCache(FileBasedCache):
+    """A FileBasedCache that checks its size at most every CULL_INTERVAL seconds.
+
+    FileBasedCache lists its whole directory on every set() to decide
+    whether to cull, which makes each device cache miss and each ingest's
+    watermark bump cost O(entries). Here that check runs at most once per
+    OPTIONS["CULL_INTERVAL"] seconds (60 by default) per process, so
+    MAX_ENTRIES can be sized for every device without slowing writes down.
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._cull_interval = params.get("OPTIONS", {}).get("CULL_INTERVAL", 60)
+        self._next_cull = 0
+        self._cull_lock = threading.Lock()
+
+    def _cull(self):
+        with self._cull_lock:
+            now = time.monotonic()
+            if now < self._next_cull:
+                return
+            self._next_cull = now + self._cull_interval
+        super()._cull()
+
+
+def shared_cache():
+    """The Django cache shared between worker processes, named by APPSTATS_CACHE."""
+    return caches[getattr(settings, "APPSTATS_CACHE", "default")]
+
+
+class LRUCache:
+    """A thread-safe, size-bounded in-process cache with per-entry expiry."""
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DeviceCache:
+    """Maps a device and its fingerprint to the resolved install and version.
+
+    Entries live in a per-process LRU. The device ID and latest version ID of
+    each install are also published in the shared cache, under the install's
+    ID so that deletes can find them without a query, and a local entry is
+    only trusted while they still match, so a device that reports a new
+    fingerprint to one worker, or an install or version deleted on one
+    worker, invalidates the entries held by the others.
+    """
+
+    def __init__(self):
+        self.local = LRUCache(
+            getattr(settings, "APPSTATS_DEVICE_CACHE_SIZE", 10000),
+            getattr(settings, "APPSTATS_DEVICE_CACHE_TIMEOUT", 60 * 60),
+        )
+
+    def _shared_key(self, install_id):
+        return f"appstats:install:{install_id}"
+
+    def get(self, app_id, device_id, fingerprint):
+        entry = self.local.get((app_id, device_id, fingerprint))
+        if entry is None:
+            return None
+        install_id, version_id = entry
+        if shared_cache().get(self._shared_key(install_id)) != (device_id, version_id):
+            self.local.delete((app_id, device_id, fingerprint))
+            return None
+        return entry
+
+    def set(self, app_id, device_id, fingerprint, install_id, version_id):
+        shared_cache().set(self._shared_key(install_id), (device_id, version_id), self.local.timeout)
+        self.local.set((app_id, device_id, fingerprint), (install_id, version_id))
+
+    def invalidate(self, install_id):
+        shared_cache().delete(self._shared_key(install_id))
+
+
+device_cache = DeviceCache()
+
+
+class AppCache:
+    """Authenticates apps by name and key from a per-process map of App rows.
+
+    Lookups for names that do not exist are cached too, so rejected requests
+    do not reach the database either. Saving or deleting any App replaces the
+    generation token in the shared cache, which invalidates every worker's
+    entries at once. That relies on APPSTATS_CACHE being shared between the
+    workers (see checks.py); with a per-process cache, other workers would
+    keep old keys for up to APPSTATS_APP_CACHE_TIMEOUT seconds.
+    """
+
+    generation_key = "appstats:apps:generation"
+
+    def __init__(self):
+        self.local = LRUCache(
+            getattr(settings, "APPSTATS_APP_CACHE_SIZE", 1000),
+            getattr(settings, "APPSTATS_APP_CACHE_TIMEOUT", 5 * 60),
+        )
+
+    def _generation(self):
+        generation = shared_cache().get(self.generation_key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            shared_cache().add(self.generation_key, generation, None)
+            generation = shared_cache().get(self.generation_key, generation)
+        return generation
+
+    def get(self, name):
+        from .models import App
+
+        generation = self._generation()
+        entry = self.local.get(name)
+        if entry is None or entry[0] != generation:
+            entry = (generation, App.objects.filter(name=name).first())
+            self.local.set(name, entry)
+        return entry[1]
+
+    async def _ageneration(self):
+        # The shared cache may be a DatabaseCache, which cannot be used
+        # synchronously on the event loop.
+        generation = await shared_cache().aget(self.generation_key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            await shared_cache().aadd(self.generation_key, generation, None)
+            generation = await shared_cache().aget(self.generation_key, generation)
+        return generation
+
+    async def aget(self, name):
+        from .models import App
+
+        generation = await self._ageneration()
+        entry = self.local.get(name)
+        if entry is None or entry[0] != generation:
+            entry = (generation, await App.objects.filter(name=name).afirst())
+            self.local.set(name, entry)
+        return entry[1]
+
+    def _check_key(self, app, key):
+        if app is None or key is None or not hmac.compare_digest(app.key.encode(), key.encode()):
+            return None
+        return copy.copy(app)
+
+    def authenticate(self, name, key):
+        """Return the App with the given name and key, or None."""
+        return self._check_key(self.get(name), key)
+
+    async def aauthenticate(self, name, key):
+        return self._check_key(await self.aget(name), key)
+
+    def invalidate(self):
+        shared_cache().set(self.generation_key, uuid.uuid4().hex, None)
+        self.local.clear()
+
+
+app_cache = AppCache()
+
+
+NavigationApp = namedtuple("NavigationApp", ["pk", "name", "slug", "active_install_count"])
+
+
+class NavigationCache:
+    """The apps listed in the navigation bar, with their headline numbers.
+
+    The list is built with one query for the apps and one for all their
+    active install counts, and kept in process. It is rebuilt when the App
+    generation token (see AppCache) changes, and otherwise every
+    APPSTATS_NAVIGATION_CACHE_TIMEOUT seconds so the counts stay fresh.
+    """
+
+    def __init__(self):
+        self.local = LRUCache(1, getattr(settings, "APPSTATS_NAVIGATION_CACHE_TIMEOUT", 60))
+
+    def apps(self):
+        generation = app_cache._generation()
+        entry = self.local.get("apps")
+        if entry is None or entry[0] != generation:
+            entry = (generation, self._build())
+            self.local.set("apps", entry)
+        return entry[1]
+
+    def _build(self):
+        from django.db.models import Count
+        from django.utils import timezone
+        from .models import ACTIVE_WINDOW, App, InstalledVersion
+
+        apps = App.objects.order_by("name")
+        counts = dict(
+            InstalledVersion.objects
+            .filter(latest=True, last_seen__gte=timezone.now() - ACTIVE_WINDOW)
+            .values_list("app")
+            .annotate(total=Count("install"))
+            .order_by()
+        )
+        return [NavigationApp(x.pk, x.name, x.slug, counts.get(x.pk, 0)) for x in apps]
+
+    def invalidate(self):
+        self.local.clear()
+
+
+navigation_cache = NavigationCache()
+
+
+class AggregateCache:
+    """Caches dashboard aggregates until the next ingest for their app.
+
+    Every key includes the app's ingest watermark, a token that is replaced
+    whenever a batch of metrics for the app is committed, so cached results
+    are never served across an ingest. Entries also expire after
+    APPSTATS_AGGREGATE_CACHE_TIMEOUT seconds, because the active window moves
+    on even when no data arrives. The backend is the Django cache named by
+    APPSTATS_AGGREGATE_CACHE, so it can be in memory, on disk or in the
+    database. An in-memory cache is private to each worker, so it only sees
+    that worker's ingests; the system checks warn about it (appstats.W001).
+    """
+
+    missing = object()
+
+    @property
+    def backend(self):
+        return caches[getattr(settings, "APPSTATS_AGGREGATE_CACHE", getattr(settings, "APPSTATS_CACHE", "default"))]
+
+    @property
+    def timeout(self):
+        return getattr(settings, "APPSTATS_AGGREGATE_CACHE_TIMEOUT", 10 * 60)
+
+    def _watermark_key(self, app_id):
+        return f"appstats:watermark:{app_id}"
+
+    def watermark(self, app_id):
+        watermark = self.backend.get(self._watermark_key(app_id))
+        if watermark is None:
+            watermark = uuid.uuid4().hex
+            self.backend.add(self._watermark_key(app_id), watermark, None)
+            watermark = self.backend.get(self._watermark_key(app_id), watermark)
+        return watermark
+
+    def bump(self, app_id):
+        self.backend.set(self._watermark_key(app_id), uuid.uuid4().hex, None)
+
+    def get_or_compute(self, app_id, name, compute):
+        digest = hashlib.md5(name.encode(), usedforsecurity=False).hexdigest()
+        key = f"appstats:aggregate:{app_id}:{self.watermark(app_id)}:{digest}"
+        value = self.backend.get(key, self.missing)
+        if value is self.missing:
+            value = compute()
+            self.backend.set(key, value, self.timeout)
+        return value
+
+
+aggregate_cache = AggregateCache()
+
+
+# Sent whenever an aggregate is actually computed, rather than served from
+# the cache or the request's memo, with the instance, method name, arguments
+# and duration in seconds.
+aggregate_computed = Signal()
+
+
+class AggregateStats:
+    """Memoized aggregates and counters for the current request."""
+
+    def __init__(self):
+        self.memo = {}
+        self.computed = 0
+        self.cached = 0
+        self.memoized = 0
+
+
+request_aggregates = contextvars.ContextVar("appstats_request_aggregates", default=None)
+
+
+def cached_aggregate(method):
+    """Cache the result of an aggregate method of an App or a metric.
+
+    Within a request (see AggregateStatsMiddleware) each result is also
+    memoized, so a page never asks for the same aggregate twice, and every
+    computation is counted.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        app_id = getattr(self, "app_id", self.pk)
+        name = f"{type(self).__name__}:{self.pk}:{method.__name__}:{args!r}"
+        stats = request_aggregates.get()
+        if stats is not None and name in stats.memo:
+            stats.memoized += 1
+            return stats.memo[name]
+
+        computed = False
+
+        def compute():
+            nonlocal computed
+            computed = True
+            start = time.perf_counter()
+            value = method(self, *args)
+            aggregate_computed.send(
+                sender=type(self),
+                instance=self,
+                method=method.__name__,
+                args=args,
+                duration=time.perf_counter() - start,
+            )
+            return value
+
+        value = aggregate_cache.get_or_compute(app_id, name, compute)
+        if stats is not None:
+            stats.memo[name] = value
+            if computed:
+                stats.computed += 1
+            else:
+                stats.cached += 1
+        return value
+
+    return wrapper
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+from .cache import PER_PROCESS_BACKENDS
+
+
+def _backend(setting):
+    alias = getattr(settings, setting, getattr(settings, "APPSTATS_CACHE", "default"))
+    return alias, settings.CACHES.get(alias, {}).get("BACKEND")
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """The device and app caches are invalidated through a cache every worker can see."""
+    errors = []
+    alias, backend = _backend("APPSTATS_CACHE")
+    if backend in PER_PROCESS_BACKENDS:
+        errors.append(Error(
+            f"APPSTATS_CACHE names the {alias!r} cache, which is not shared between processes.",
+            hint=(
+                "Point it at a cache every worker can see, such as FileBasedCache, "
+                "DatabaseCache, Redis or Memcached. Otherwise deleted installs and changed "
+                "app keys are not seen by the other workers until their entries expire."
+            ),
+            id="appstats.E001",
+        ))
+    alias, backend = _backend("APPSTATS_AGGREGATE_CACHE")
+    if backend in PER_PROCESS_BACKENDS:
+        errors.append(Warning(
+            f"APPSTATS_AGGREGATE_CACHE names the {alias!r} cache, which is not shared between processes.",
+            hint=(
+                "This is fine with a single worker. With several, each only sees its own "
+                "ingests, so dashboards can lag new data by up to "
+                "APPSTATS_AGGREGATE_CACHE_TIMEOUT seconds."
+            ),
+            id="appstats.W001",
+        ))
+    return errors
@@ -1,7 +1,9 @@
-from .models import App
+from django.utils.functional import SimpleLazyObject
+
+from .cache import navigation_cache
 
 
 def appstats(request):
     return {
-        "APPS": App.objects.all().order_by("name"),
+        "APPS": SimpleLazyObject(navigation_cache.apps),
     }
@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from appstats.models import App, Gauge, Event
+
+
+KINDS = {
+    "gauges": Gauge,
+    "events": Event,
+}
+
+# The raw rows of each kind that retention applies to, as the related name
+# on the metric and the date they expire by. Gauge summaries written by
+# compact_gauges are raw readings too, just compacted.
+EXPIRING = {
+    "gauges": (("instances", "date_created"), ("summaries", "bucket")),
+    "events": (("instances", "date_created"),),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete raw gauge readings, gauge summaries and events older than each app's retention period. "
+        "Rows are deleted oldest first in small transactions, one metric at a time, so "
+        "the command can be stopped at any point and simply run again to carry on. "
+        "Rollups, sketches and unique device registers are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--app", action="append", dest="apps", help="Only prune this app (may be repeated).")
+        parser.add_argument("--kind", action="append", dest="kinds", choices=KINDS, help="Only prune this kind of metric (may be repeated).")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows deleted per transaction.")
+        parser.add_argument("--time-limit", type=float, help="Stop after this many seconds; run again to resume.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many rows would be deleted.")
+
+    def handle(self, *args, **options):
+        deadline = time.monotonic() + options["time_limit"] if options["time_limit"] else None
+        apps = App.objects.all()
+        if options["apps"]:
+            apps = apps.filter(name__in=options["apps"])
+        for app in apps:
+            for kind in options["kinds"] or KINDS:
+                cutoff = app.retention_cutoff(kind)
+                if cutoff is None:
+                    continue
+                for metric in KINDS[kind].objects.filter(app=app):
+                    for name, date_field in EXPIRING[kind]:
+                        expired = getattr(metric, name).filter(**{f"{date_field}__lt": cutoff})
+                        if options["dry_run"]:
+                            self.stdout.write(f"{metric}: {expired.count()} {name} before {cutoff:%Y-%m-%d %H:%M}")
+                            continue
+                        deleted, finished = self.prune(expired, date_field, options["batch_size"], deadline)
+                        if deleted:
+                            self.stdout.write(f"{metric}: deleted {deleted} {name} before {cutoff:%Y-%m-%d %H:%M}")
+                        if not finished:
+                            self.stdout.write("Time limit reached; run again to continue.")
+                            return
+
+    def prune(self, expired, date_field, batch_size, deadline):
+        """Delete the rows of a queryset in batches, returning the count and whether all were deleted."""
+        deleted = 0
+        while deadline is None or time.monotonic() < deadline:
+            with transaction.atomic():
+                ids = list(expired.order_by(date_field).values_list("pk", flat=True)[:batch_size])
+                if not ids:
+                    return deleted, True
+                deleted += expired.model.objects.filter(pk__in=ids).delete()[0]
+        return deleted, False
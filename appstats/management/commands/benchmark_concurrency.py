@@ -0,0 +1,79 @@
+import http.client
+import json
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+from .benchmark_validation import sample_payload
+
+
+class Command(BaseCommand):
+    help = (
+        "Send concurrent, optionally slow, ingest uploads to a running server and report "
+        "throughput and latency. Run it once against the WSGI deployment and once against "
+        "the ASGI one (webapp.asgi) to compare them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="Base URL of the server, e.g. http://127.0.0.1:8000")
+        parser.add_argument("--app", required=True, help="Name of the app to post to.")
+        parser.add_argument("--key", required=True, help="Key of the app to post to.")
+        parser.add_argument("--concurrency", type=int, default=100, help="Number of simultaneous clients.")
+        parser.add_argument("--requests", type=int, default=1000, help="Total number of uploads.")
+        parser.add_argument("--metrics", type=int, default=20, help="Counters per upload.")
+        parser.add_argument("--chunks", type=int, default=1, help="Pieces each body is sent in.")
+        parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds to wait between pieces, simulating a slow connection.")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["url"])
+        path = f"/api/counters/{options['app']}/?key={options['key']}"
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        local = threading.local()
+
+        def upload(_index):
+            data = sample_payload("counters", options["metrics"])
+            data["device"]["device_id"] = str(uuid.uuid4())
+            body = json.dumps(data).encode()
+            size = -(-len(body) // options["chunks"])
+
+            start = time.perf_counter()
+            connection = getattr(local, "connection", None)
+            if connection is None:
+                connection = local.connection = connection_class(url.netloc, timeout=300)
+            try:
+                connection.putrequest("POST", path)
+                connection.putheader("Content-Type", "application/json")
+                connection.putheader("Content-Length", str(len(body)))
+                connection.endheaders()
+                for offset in range(0, len(body), size):
+                    if offset:
+                        time.sleep(options["chunk_delay"])
+                    connection.send(body[offset:offset + size])
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                local.connection = None
+                status = None
+            return status, time.perf_counter() - start
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            results = list(executor.map(upload, range(options["requests"])))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for status, latency in results if status is not None and status < 400)
+        failures = len(results) - len(latencies)
+        self.stdout.write(f"{len(results)} uploads with {options['concurrency']} clients in {elapsed:.2f}s ({len(results) / elapsed:.1f}/s), {failures} failed")
+        if latencies:
+            quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            self.stdout.write(
+                f"latency p50 {quantiles[49] * 1000:.1f}ms, p95 {quantiles[94] * 1000:.1f}ms, "
+                f"p99 {quantiles[98] * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms"
+            )
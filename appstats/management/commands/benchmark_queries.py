@@ -0,0 +1,195 @@
+import datetime
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from appstats.models import (
+    App, Counter, Gauge, Event, Install, InstalledVersion, CounterInstance, GaugeInstance, EventInstance,
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+# Alias of the temporary SQLite database used when --database is not given.
+SCRATCH_ALIAS = "benchmark"
+
+
+def hot_queries(app, counter, gauge, event, install, version):
+    """The query shapes the indexes are meant for, by name.
+
+    Related managers follow the database `app` was loaded from; the
+    querysets of other models are routed to it explicitly.
+    """
+    using = app._state.db
+    week_ago = timezone.now() - datetime.timedelta(days=7)
+    return {
+        "active installs": app.active_install_versions().values("install"),
+        "active versions by model": app.active_installs_by_parameter("model"),
+        "latest version of install": install.versions.filter(latest=True),
+        "counter instance": CounterInstance.objects.using(using).filter(counter=counter, install=install, version=version),
+        "gauge readings of install": GaugeInstance.objects.using(using).filter(gauge=gauge, install=install),
+        "gauge series": (
+            gauge.instances.filter(date_created__gte=week_ago)
+            .annotate(bucket=Trunc("date_created", "hour")).values("bucket")
+            .annotate(total=models.Count("id"), mean=models.Avg("value")).order_by()
+        ),
+        "event series": (
+            event.instances.filter(date_created__gte=week_ago)
+            .annotate(bucket=Trunc("date_created", "hour")).values("bucket")
+            .annotate(total=models.Count("id")).order_by()
+        ),
+        "counter rollup total": counter.active_rollups().values("counter").annotate(total=models.Sum("total")).order_by(),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a synthetic dataset inside a transaction, then record the EXPLAIN output and "
+        "timings of the hottest dashboard and ingest queries. The data is rolled back "
+        "afterwards. It is written to a temporary SQLite database unless --database names a "
+        "configured one, which should be a copy of production rather than production itself. "
+        "Save the results with --output and compare them between runs to spot index regressions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--installs", type=int, default=10000, help="Number of synthetic installs.")
+        parser.add_argument("--readings", type=int, default=20, help="Gauge readings and events per install.")
+        parser.add_argument("--repeat", type=int, default=20, help="Runs of each query to time.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows inserted per query.")
+        parser.add_argument("--output", help="Write the plans and timings to this JSON file.")
+        parser.add_argument(
+            "--database",
+            help="Alias of a configured database to benchmark, e.g. a copy of production. "
+                 "By default a temporary SQLite database is created and migrated.",
+        )
+
+    def handle(self, *args, **options):
+        if options["database"] is not None:
+            if options["database"] not in connections:
+                raise CommandError(f"Unknown database alias: {options['database']}.")
+            results = self.run_in_transaction(options["database"], options)
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                self.add_scratch_database(Path(directory) / "benchmark.sqlite3")
+                try:
+                    results = self.run_in_transaction(SCRATCH_ALIAS, options)
+                finally:
+                    connections[SCRATCH_ALIAS].close()
+                    del connections[SCRATCH_ALIAS]
+                    del connections.settings[SCRATCH_ALIAS]
+
+        for name, result in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(result["plan"])
+            self.stdout.write(f"median {result['median'] * 1000:.2f}ms, max {result['max'] * 1000:.2f}ms")
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({"vendor": self.vendor, "options": options, "queries": results}, f, indent=2, default=str)
+
+    def add_scratch_database(self, path):
+        configured = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            SCRATCH_ALIAS: {"ENGINE": "django.db.backends.sqlite3", "NAME": str(path)},
+        })
+        connections.settings[SCRATCH_ALIAS] = configured[SCRATCH_ALIAS]
+        self.stdout.write(f"Migrating a temporary database at {path}")
+        call_command("migrate", database=SCRATCH_ALIAS, verbosity=0)
+
+    def run_in_transaction(self, using, options):
+        self.vendor = connections[using].vendor
+        try:
+            with transaction.atomic(using=using):
+                results = self.run(using, options)
+                raise Rollback
+        except Rollback:
+            pass
+        return results
+
+    def run(self, using, options):
+        started = time.perf_counter()
+        app, metrics, installs, versions = self.populate(using, options)
+        self.stdout.write(f"Populated {len(installs)} installs in {time.perf_counter() - started:.1f}s")
+
+        queries = hot_queries(app, *metrics, installs[len(installs) // 2], versions[len(versions) // 2])
+        results = {}
+        for name, queryset in queries.items():
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - start)
+            results[name] = {
+                "plan": queryset.explain(),
+                "median": statistics.median(timings),
+                "max": max(timings),
+            }
+        return results
+
+    def populate(self, using, options):
+        random.seed(0)
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        app = App.objects.using(using).create(name=f"Benchmark {now.timestamp()}", slug=f"benchmark-{int(now.timestamp())}", key="benchmark")
+        counter = Counter.objects.using(using).create(app=app, name="launches")
+        gauge = Gauge.objects.using(using).create(app=app, name="launch_time")
+        event = Event.objects.using(using).create(app=app, name="opened")
+
+        installs = Install.objects.using(using).bulk_create(
+            [Install(app=app, device_id=f"{app.slug}-{i}") for i in range(options["installs"])],
+            batch_size=batch_size,
+        )
+        # auto_now would otherwise put every install in the active window.
+        for install in installs:
+            install.date_updated = now - datetime.timedelta(days=random.randint(0, 120))
+        Install.objects.using(using).bulk_update(installs, ["date_updated"], batch_size=batch_size)
+
+        versions = InstalledVersion.objects.using(using).bulk_create([
+            InstalledVersion(
+                app=app,
+                install=install,
+                model=f"iPhone{random.randint(10, 15)},{random.randint(1, 4)}",
+                app_version=f"1.{build % 5}",
+                build_number=str(build),
+                os_name="iOS",
+                os_version=f"{random.randint(14, 17)}.0",
+                os_version_string="iOS",
+                latest=build == 2,
+                last_seen=install.date_updated,
+            )
+            for install in installs
+            for build in range(3)
+        ], batch_size=batch_size)
+        latest = [x for x in versions if x.latest]
+
+        CounterInstance.objects.using(using).bulk_create([
+            CounterInstance(counter=counter, install=x.install, version=x, count=1, date_created=now, date_updated=now)
+            for x in latest
+        ], batch_size=batch_size)
+        readings = [
+            (x, now - datetime.timedelta(minutes=random.randint(0, 60 * 24 * 30)))
+            for x in latest
+            for _ in range(options["readings"])
+        ]
+        GaugeInstance.objects.using(using).bulk_create([
+            GaugeInstance(gauge=gauge, install=x.install, version=x, value=random.lognormvariate(0, 1), date_created=date)
+            for x, date in readings
+        ], batch_size=batch_size)
+        EventInstance.objects.using(using).bulk_create([
+            EventInstance(event=event, install=x.install, version=x, attributes={}, date_created=date)
+            for x, date in readings
+        ], batch_size=batch_size)
+
+        with connections[using].cursor() as cursor:
+            cursor.execute("ANALYZE")
+        return app, (counter, gauge, event), installs, latest
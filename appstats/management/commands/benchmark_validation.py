@@ -0,0 +1,53 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from jsonschema import validate
+
+from appstats.models import COUNTERS_SCHEMA, GAUGES_SCHEMA, EVENTS_SCHEMA
+from appstats.validation import VALIDATORS, validate_payload
+
+
+SCHEMAS = {
+    "counters": COUNTERS_SCHEMA,
+    "gauges": GAUGES_SCHEMA,
+    "events": EVENTS_SCHEMA,
+}
+
+
+def sample_payload(kind, size):
+    device = {
+        "device_id": "00000000-0000-0000-0000-000000000000",
+        "model": "iPhone14,2",
+        "app_version": "1.0",
+        "build_number": "1",
+        "os_name": "iOS",
+        "os_version": "16.0",
+        "os_version_string": "Version 16.0 (Build 20A362)",
+    }
+    items = {
+        "counters": [{"name": f"counter{i}", "count": i, "dateCreated": 1666000000, "dateUpdated": 1666000000} for i in range(size)],
+        "gauges": [{"name": f"gauge{i}", "value": i * 0.5, "dateCreated": 1666000000} for i in range(size)],
+        "events": [{"name": f"event{i}", "attributes": {"index": i}, "dateCreated": 1666000000} for i in range(size)],
+    }
+    return {kind: items[kind], "device": device}
+
+
+class Command(BaseCommand):
+    help = "Compare jsonschema.validate with the precompiled and fast-path payload validators."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=20, help="Number of metrics per payload.")
+        parser.add_argument("--number", type=int, default=2000, help="Validations per measurement.")
+
+    def handle(self, *args, **options):
+        size, number = options["size"], options["number"]
+        self.stdout.write(f"{'payload':<10}{'jsonschema.validate':>22}{'precompiled':>14}{'fast path':>12}   (µs per payload, {size} metrics)")
+        for kind, schema in SCHEMAS.items():
+            data = sample_payload(kind, size)
+            validator = VALIDATORS[kind]
+            timings = [
+                timeit.timeit(lambda: validate(instance=data, schema=schema), number=number),
+                timeit.timeit(lambda: validator.validate(data), number=number),
+                timeit.timeit(lambda: validate_payload(data, kind), number=number),
+            ]
+            self.stdout.write(f"{kind:<10}" + "".join(f"{t / number * 1e6:>{w}.1f}" for t, w in zip(timings, (22, 14, 12))))
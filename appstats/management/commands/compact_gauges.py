@@ -0,0 +1,115 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from appstats.models import GAUGE_SKETCH_ACCURACY, App, Gauge, GaugeInstance, GaugeSummary
+from appstats.sketches import DDSketch
+
+
+RESOLUTIONS = ("hour", "day")
+
+
+def bucket_start(date, resolution):
+    date = timezone.localtime(date).replace(minute=0, second=0, microsecond=0)
+    if resolution == "day":
+        date = date.replace(hour=0)
+    return date
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact gauge readings older than --older-than days into hourly or daily summaries "
+        "per gauge and installed version, and delete the raw rows. Each batch is summarized "
+        "and deleted in one transaction, so the command can be stopped at any point and run "
+        "again to carry on. The gauge series, rollups and sketches include compacted readings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--app", action="append", dest="apps", help="Only compact this app (may be repeated).")
+        parser.add_argument("--older-than", type=int, default=7, help="Compact readings older than this many days.")
+        parser.add_argument("--resolution", choices=RESOLUTIONS, default="hour", help="Length of each summary bucket.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Raw readings compacted per transaction.")
+        parser.add_argument("--time-limit", type=float, help="Stop after this many seconds; run again to resume.")
+
+    def handle(self, *args, **options):
+        deadline = time.monotonic() + options["time_limit"] if options["time_limit"] else None
+        # Only compact whole buckets, so later readings never land in one
+        # that has already been summarized.
+        cutoff = bucket_start(timezone.now() - datetime.timedelta(days=options["older_than"]), options["resolution"])
+        apps = App.objects.all()
+        if options["apps"]:
+            apps = apps.filter(name__in=options["apps"])
+        for gauge in Gauge.objects.filter(app__in=apps):
+            compacted = 0
+            while deadline is None or time.monotonic() < deadline:
+                count = self.compact_batch(gauge, cutoff, options["resolution"], options["batch_size"])
+                if not count:
+                    break
+                compacted += count
+            if compacted:
+                self.stdout.write(f"{gauge}: compacted {compacted} readings before {cutoff:%Y-%m-%d %H:%M}")
+            if deadline is not None and time.monotonic() >= deadline:
+                self.stdout.write("Time limit reached; run again to continue.")
+                return
+
+    @transaction.atomic
+    def compact_batch(self, gauge, cutoff, resolution, batch_size):
+        readings = list(
+            gauge.instances.filter(date_created__lt=cutoff)
+            .order_by("date_created")
+            .values_list("pk", "version_id", "date_created", "value")[:batch_size]
+        )
+        if not readings:
+            return 0
+
+        summaries = {}
+        for _pk, version_id, date_created, value in readings:
+            key = (version_id, bucket_start(date_created, resolution))
+            summary = summaries.get(key)
+            if summary is None:
+                summary = summaries[key] = GaugeSummary(
+                    gauge=gauge,
+                    version_id=version_id,
+                    bucket=key[1],
+                    count=0,
+                    sum=0.0,
+                    min=value,
+                    max=value,
+                )
+                summary.digest = DDSketch(GAUGE_SKETCH_ACCURACY)
+            summary.count += 1
+            summary.sum += value
+            summary.min = min(summary.min, value)
+            summary.max = max(summary.max, value)
+            summary.digest.add(value)
+
+        # A bucket may span batches, or gain late readings, so merge into any
+        # summary that already exists for it.
+        existing = GaugeSummary.objects.select_for_update().filter(
+            gauge=gauge,
+            version_id__in={version_id for version_id, _bucket in summaries},
+            bucket__in={bucket for _version_id, bucket in summaries},
+        )
+        updates = []
+        for summary in existing:
+            new = summaries.pop((summary.version_id, summary.bucket), None)
+            if new is None:
+                continue
+            summary.count += new.count
+            summary.sum += new.sum
+            summary.min = min(summary.min, new.min)
+            summary.max = max(summary.max, new.max)
+            sketch = DDSketch.from_list(GAUGE_SKETCH_ACCURACY, summary.sketch)
+            sketch.merge(new.digest)
+            summary.sketch = sketch.to_list()
+            updates.append(summary)
+        GaugeSummary.objects.bulk_update(updates, ["count", "sum", "min", "max", "sketch"])
+        for summary in summaries.values():
+            summary.sketch = summary.digest.to_list()
+        GaugeSummary.objects.bulk_create(summaries.values())
+
+        GaugeInstance.objects.filter(pk__in=[pk for pk, *_rest in readings]).delete()
+        return len(readings)
@@ -0,0 +1,76 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from appstats.models import App, SpoolCheckpoint
+from appstats.spool import get_spool
+
+
+class Command(BaseCommand):
+    help = "Write spooled ingest payloads to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Payloads written per transaction.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling the spool instead of exiting when it is empty.")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds to wait between polls with --loop.")
+
+    def handle(self, *args, **options):
+        spool = get_spool()
+        if spool is None:
+            raise CommandError("APPSTATS_SPOOL_PATH is not set.")
+
+        SpoolCheckpoint.objects.get_or_create(name=spool.path)
+        while True:
+            written = self.drain_batch(spool, options["batch_size"])
+            if written:
+                self.stdout.write(f"Wrote {written} payloads.")
+            elif options["loop"]:
+                time.sleep(options["interval"])
+            else:
+                break
+
+    def drain_batch(self, spool, batch_size):
+        # The checkpoint is advanced in the same transaction as the data it
+        # covers, so a crash at any point replays each payload exactly once.
+        with transaction.atomic():
+            checkpoint = SpoolCheckpoint.objects.select_for_update().get(name=spool.path)
+            rows = spool.read(checkpoint.last_id, batch_size)
+            if not rows:
+                # Trim anything left over from a run that stopped between
+                # committing the checkpoint and trimming the spool.
+                transaction.on_commit(lambda: spool.delete_through(checkpoint.last_id))
+                return 0
+            apps = App.objects.in_bulk({app_id for _id, app_id, _data in rows})
+
+            try:
+                with transaction.atomic():
+                    for app_id, data in self.merge(rows):
+                        if app_id in apps:
+                            apps[app_id].ingest(data)
+            except Exception:
+                for id, app_id, data in rows:
+                    if app_id not in apps:
+                        continue
+                    try:
+                        with transaction.atomic():
+                            apps[app_id].ingest(data)
+                    except Exception as err:
+                        self.stderr.write(f"Skipping spooled payload {id}: {err!r}")
+
+            checkpoint.last_id = rows[-1][0]
+            checkpoint.save()
+
+        spool.delete_through(checkpoint.last_id)
+        return len(rows)
+
+    def merge(self, rows):
+        """Combine payloads from the same device so it is only resolved once per batch."""
+        merged = {}
+        for _id, app_id, data in rows:
+            key = (app_id, json.dumps(data["device"], sort_keys=True))
+            batch = merged.setdefault(key, {"device": data["device"]})
+            for kind in ("counters", "gauges", "events"):
+                batch.setdefault(kind, []).extend(data.get(kind, ()))
+        return [(app_id, data) for (app_id, _device), data in merged.items()]
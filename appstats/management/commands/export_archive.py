@@ -0,0 +1,101 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from appstats.archive import FLOAT64, INT64, JSON, NUMBER, STRING, PartitionWriter, partition_path
+from appstats.models import ROLLUP_DIMENSIONS, App
+
+
+DIMENSIONS = [(x, STRING, None) for x in ROLLUP_DIMENSIONS]
+
+# For each kind of rows: the metrics they belong to, their related name on
+# the metric, the columns written and the fields they are read from, with
+# the version dimensions and device joined in the same query. The first
+# field is the date that rows are partitioned by. Gauge readings compacted
+# by compact_gauges are only in "gauge_summaries".
+KINDS = {
+    "gauges": (
+        "gauges",
+        "instances",
+        [("timestamp", NUMBER, INT64), ("value", NUMBER, FLOAT64), ("install_id", NUMBER, INT64), ("device_id", STRING, None), *DIMENSIONS],
+        ["date_created", "value", "install_id", "install__device_id", *(f"version__{x}" for x in ROLLUP_DIMENSIONS)],
+    ),
+    "gauge_summaries": (
+        "gauges",
+        "summaries",
+        [
+            ("timestamp", NUMBER, INT64), ("count", NUMBER, INT64), ("sum", NUMBER, FLOAT64), ("min", NUMBER, FLOAT64),
+            ("max", NUMBER, FLOAT64), ("install_id", NUMBER, INT64), ("device_id", STRING, None), *DIMENSIONS, ("sketch", JSON, None),
+        ],
+        [
+            "bucket", "count", "sum", "min", "max", "version__install_id", "version__install__device_id",
+            *(f"version__{x}" for x in ROLLUP_DIMENSIONS), "sketch",
+        ],
+    ),
+    "events": (
+        "events",
+        "instances",
+        [("timestamp", NUMBER, INT64), ("install_id", NUMBER, INT64), ("device_id", STRING, None), *DIMENSIONS, ("attributes", JSON, None)],
+        ["date_created", "install_id", "install__device_id", *(f"version__{x}" for x in ROLLUP_DIMENSIONS), "attributes"],
+    ),
+}
+
+
+def parse_day(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"{value!r} is not a date in YYYY-MM-DD format.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Export gauge readings, compacted gauge summaries and events to a columnar archive, "
+        "partitioned by app, kind, metric and day, that can be read with appstats.archive.Archive. "
+        "Rows are streamed from the database in chunks, and partitions that already exist are "
+        "replaced. Number columns are written uncompressed so they can be memory-mapped; "
+        "compress the archive as a whole if it is stored rather than queried."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Directory to write the archive to.")
+        parser.add_argument("--app", action="append", dest="apps", help="Only export this app (may be repeated).")
+        parser.add_argument("--kind", action="append", dest="kinds", choices=KINDS, help="Only export this kind of metric (may be repeated).")
+        parser.add_argument("--since", type=parse_day, help="First day to export.")
+        parser.add_argument("--until", type=parse_day, help="Last day to export.")
+        parser.add_argument("--batch-size", type=int, default=10000, help="Rows fetched from the database at a time.")
+
+    def handle(self, *args, **options):
+        apps = App.objects.all()
+        if options["apps"]:
+            apps = apps.filter(name__in=options["apps"])
+        for app in apps:
+            for kind in options["kinds"] or KINDS:
+                for metric in getattr(app, KINDS[kind][0]).all():
+                    rows, partitions = self.export(options["path"], app, kind, metric, options)
+                    if rows:
+                        self.stdout.write(f"{metric}: {rows} rows in {partitions} partitions")
+
+    def export(self, path, app, kind, metric, options):
+        metrics, related_name, columns, fields = KINDS[kind]
+        date_field = fields[0]
+        instances = getattr(metric, related_name).order_by(date_field)
+        if options["since"]:
+            instances = instances.filter(**{f"{date_field}__gte": timezone.make_aware(datetime.datetime.combine(options["since"], datetime.time.min))})
+        if options["until"]:
+            instances = instances.filter(**{f"{date_field}__lt": timezone.make_aware(datetime.datetime.combine(options["until"] + datetime.timedelta(days=1), datetime.time.min))})
+
+        writer, day, rows, partitions = None, None, 0, 0
+        for date_created, *values in instances.values_list(*fields).iterator(chunk_size=options["batch_size"]):
+            if timezone.localdate(date_created) != day:
+                if writer is not None:
+                    writer.close()
+                day = timezone.localdate(date_created)
+                writer = PartitionWriter(partition_path(path, app.slug, kind, metric.name, day), columns)
+                partitions += 1
+            writer.append((round(date_created.timestamp() * 1_000_000), *values))
+            rows += 1
+        if writer is not None:
+            writer.close()
+        return rows, partitions
@@ -0,0 +1,174 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from appstats.cache import aggregate_cache
+from appstats.models import (
+    GAUGE_SKETCH_ACCURACY, ROLLUP_DIMENSIONS, App, Counter, Gauge, Event, CounterRollup, GaugeRollup, EventRollup, GaugeSketchBin,
+    CounterDeviceRegister, GaugeDeviceRegister, EventDeviceRegister, unique_devices_precision,
+)
+from appstats.sketches import DDSketch, HyperLogLog
+
+
+# For each kind of metric: the rollup model, the foreign key from the rollup
+# and the instance date the rollup day comes from.
+KINDS = {
+    "counters": (Counter, CounterRollup, "counter", "date_updated"),
+    "gauges": (Gauge, GaugeRollup, "gauge", "date_created"),
+    "events": (Event, EventRollup, "event", "date_created"),
+}
+
+REGISTER_MODELS = {
+    "counters": CounterDeviceRegister,
+    "gauges": GaugeDeviceRegister,
+    "events": EventDeviceRegister,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily rollups from the raw metric instances. Counter instances only "
+        "keep a running total, so each one is attributed to the day it was last updated. "
+        "Unique device registers and gauge quantile sketches are rebuilt along with the rollups, "
+        "including gauge readings that compact_gauges has summarized. When an app has a retention "
+        "period, days whose raw rows apply_retention may already have deleted are left as they are."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--app", action="append", dest="apps", help="Only rebuild this app (may be repeated).")
+        parser.add_argument("--kind", action="append", dest="kinds", choices=KINDS, help="Only rebuild this kind of metric (may be repeated).")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rollup rows inserted per query.")
+
+    def handle(self, *args, **options):
+        apps = App.objects.all()
+        if options["apps"]:
+            apps = apps.filter(name__in=options["apps"])
+        for app in apps:
+            for kind in options["kinds"] or KINDS:
+                metric_model, rollup_model, metric_field, date_field = KINDS[kind]
+                since = self.first_complete_day(app, kind)
+                if since is not None:
+                    self.stdout.write(f"{app} {kind}: keeping the rollups before {since}, which retention may have pruned")
+                for metric in metric_model.objects.filter(app=app):
+                    rows = self.rebuild(metric, rollup_model, metric_field, date_field, since, options["batch_size"])
+                    self.stdout.write(f"{metric}: {rows} rollup rows")
+                    registers = self.rebuild_registers(metric, REGISTER_MODELS[kind], metric_field, date_field, since, options["batch_size"])
+                    self.stdout.write(f"{metric}: {registers} device registers")
+                    if kind == "gauges":
+                        bins = self.rebuild_sketch(metric, since, options["batch_size"])
+                        self.stdout.write(f"{metric}: {bins} sketch bins")
+            aggregate_cache.bump(app.pk)
+
+    def first_complete_day(self, app, kind):
+        """Return the first day whose raw rows are all retained, or None if nothing is pruned.
+
+        Counter instances are never pruned. For gauges and events, the day
+        of the retention cutoff is already partly deleted, so rebuilding
+        starts the day after it.
+        """
+        if kind == "counters":
+            return None
+        cutoff = app.retention_cutoff(kind)
+        if cutoff is None:
+            return None
+        return timezone.localdate(cutoff) + datetime.timedelta(days=1)
+
+    @transaction.atomic
+    def rebuild(self, metric, rollup_model, metric_field, date_field, since, batch_size):
+        stale = rollup_model.objects.filter(**{metric_field: metric})
+        if since is not None:
+            stale = stale.filter(day__gte=since)
+        stale.delete()
+        dimensions = [f"version__{x}" for x in ROLLUP_DIMENSIONS]
+        sources = [
+            metric.instances
+            .annotate(day=TruncDate(date_field))
+            .values_list("day", *dimensions)
+            .annotate(total=metric._aggregate())
+        ]
+        if isinstance(metric, Gauge):
+            sources.append(
+                metric.summaries
+                .annotate(day=TruncDate("bucket"))
+                .values_list("day", *dimensions)
+                .annotate(total=Sum("count"))
+            )
+        if since is not None:
+            sources = [x.filter(day__gte=since) for x in sources]
+        totals = {}
+        for groups in sources:
+            for day, *values, total in groups.order_by().iterator(chunk_size=batch_size):
+                key = (day, *values)
+                totals[key] = totals.get(key, 0) + total
+        rollups = [
+            rollup_model(
+                **{metric_field: metric, "day": day, "total": total},
+                **dict(zip(ROLLUP_DIMENSIONS, values)),
+            )
+            for (day, *values), total in totals.items()
+        ]
+        return len(rollup_model.objects.bulk_create(rollups, batch_size=batch_size))
+
+    @transaction.atomic
+    def rebuild_sketch(self, gauge, since, batch_size):
+        stale = GaugeSketchBin.objects.filter(gauge=gauge)
+        readings = gauge.instances.annotate(day=TruncDate("date_created")).values_list("day", "value")
+        summaries = gauge.summaries.annotate(day=TruncDate("bucket")).values_list("day", "sketch")
+        if since is not None:
+            stale = stale.filter(day__gte=since)
+            readings = readings.filter(day__gte=since)
+            summaries = summaries.filter(day__gte=since)
+        stale.delete()
+        sketch = DDSketch(GAUGE_SKETCH_ACCURACY)
+        counts = {}
+        for day, value in readings.iterator(chunk_size=batch_size):
+            key = (day, *sketch.key(value))
+            counts[key] = counts.get(key, 0) + 1
+        for day, summary_bins in summaries.iterator(chunk_size=batch_size):
+            for sign, index, count in summary_bins:
+                counts[(day, sign, index)] = counts.get((day, sign, index), 0) + count
+        bins = [
+            GaugeSketchBin(gauge=gauge, day=day, sign=sign, index=index, count=count)
+            for (day, sign, index), count in counts.items()
+        ]
+        return len(GaugeSketchBin.objects.bulk_create(bins, batch_size=batch_size))
+
+    @transaction.atomic
+    def rebuild_registers(self, metric, register_model, metric_field, date_field, since, batch_size):
+        stale = register_model.objects.filter(**{metric_field: metric})
+        if since is not None:
+            stale = stale.filter(day__gte=since)
+        stale.delete()
+        sketch = HyperLogLog(unique_devices_precision())
+        ranks = {}
+        dimensions = [f"version__{x}" for x in ROLLUP_DIMENSIONS]
+        sources = [
+            metric.instances
+            .annotate(day=TruncDate(date_field))
+            .values_list("day", "install__device_id", *dimensions)
+        ]
+        if isinstance(metric, Gauge):
+            sources.append(
+                metric.summaries
+                .annotate(day=TruncDate("bucket"))
+                .values_list("day", "version__install__device_id", *dimensions)
+            )
+        if since is not None:
+            sources = [x.filter(day__gte=since) for x in sources]
+        for reports in sources:
+            for day, device_id, *values in reports.distinct().iterator(chunk_size=batch_size):
+                register, rank = sketch.register(device_id)
+                key = (day, *values, register)
+                ranks[key] = max(ranks.get(key, 0), rank)
+        registers = [
+            register_model(
+                **{metric_field: metric, "day": day, "register": register, "rank": rank},
+                **dict(zip(ROLLUP_DIMENSIONS, values)),
+            )
+            for (day, *values, register), rank in ranks.items()
+        ]
+        return len(register_model.objects.bulk_create(registers, batch_size=batch_size))
@@ -0,0 +1,53 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .cache import AggregateStats, request_aggregates
+
+
+logger = logging.getLogger("appstats.aggregates")
+
+
+class AggregateStatsMiddleware:
+    """Memoizes aggregates for the duration of a request and reports how many were computed.
+
+    The counts are logged to the appstats.aggregates logger and returned in
+    an X-AppStats-Aggregates response header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = AggregateStats()
+        token = request_aggregates.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_aggregates.reset(token)
+        return self._report(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = AggregateStats()
+        token = request_aggregates.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_aggregates.reset(token)
+        return self._report(request, response, stats)
+
+    def _report(self, request, response, stats):
+        if stats.computed or stats.cached or stats.memoized:
+            response["X-AppStats-Aggregates"] = f"computed={stats.computed}, cached={stats.cached}, memoized={stats.memoized}"
+            logger.debug(
+                "%s: %d aggregates computed, %d cached, %d memoized",
+                request.path, stats.computed, stats.cached, stats.memoized,
+            )
+        return response
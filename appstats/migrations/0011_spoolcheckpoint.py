@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-17 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0010_installedversion_latest"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpoolCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("last_id", models.BigIntegerField(default=0)),
+                ("date_updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-17 16:16
+
+from django.db import migrations, models
+
+
+def merge_duplicate_instances(apps, schema_editor):
+    CounterInstance = apps.get_model("appstats", "CounterInstance")
+    db_alias = schema_editor.connection.alias
+    duplicates = (
+        CounterInstance.objects.using(db_alias).values("counter", "install", "version")
+        .annotate(total=models.Count("id"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        instances = list(
+            CounterInstance.objects.using(db_alias).filter(
+                counter=duplicate["counter"],
+                install=duplicate["install"],
+                version=duplicate["version"],
+            ).order_by("pk")
+        )
+        instance = instances[0]
+        instance.count = sum(x.count for x in instances)
+        instance.date_created = min(x.date_created for x in instances)
+        instance.date_updated = max(x.date_updated for x in instances)
+        instance.save(using=db_alias)
+        CounterInstance.objects.using(db_alias).filter(pk__in=[x.pk for x in instances[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0011_spoolcheckpoint"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_instances, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="counterinstance",
+            constraint=models.UniqueConstraint(
+                fields=("counter", "install", "version"), name="unique_counter_instance"
+            ),
+        ),
+    ]
@@ -0,0 +1,146 @@
+# Generated by Django 4.2.30 on 2026-10-17 16:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0012_counterinstance_unique"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GaugeRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("model", models.CharField(max_length=255)),
+                ("os_name", models.CharField(max_length=255)),
+                ("os_version", models.CharField(max_length=255)),
+                ("app_version", models.CharField(max_length=255)),
+                ("build_number", models.CharField(max_length=255)),
+                ("total", models.BigIntegerField(default=0)),
+                (
+                    "gauge",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to="appstats.gauge",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="EventRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("model", models.CharField(max_length=255)),
+                ("os_name", models.CharField(max_length=255)),
+                ("os_version", models.CharField(max_length=255)),
+                ("app_version", models.CharField(max_length=255)),
+                ("build_number", models.CharField(max_length=255)),
+                ("total", models.BigIntegerField(default=0)),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to="appstats.event",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="CounterRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("model", models.CharField(max_length=255)),
+                ("os_name", models.CharField(max_length=255)),
+                ("os_version", models.CharField(max_length=255)),
+                ("app_version", models.CharField(max_length=255)),
+                ("build_number", models.CharField(max_length=255)),
+                ("total", models.BigIntegerField(default=0)),
+                (
+                    "counter",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to="appstats.counter",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="gaugerollup",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "gauge",
+                    "day",
+                    "model",
+                    "os_name",
+                    "os_version",
+                    "app_version",
+                    "build_number",
+                ),
+                name="unique_gauge_rollup",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="eventrollup",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "event",
+                    "day",
+                    "model",
+                    "os_name",
+                    "os_version",
+                    "app_version",
+                    "build_number",
+                ),
+                name="unique_event_rollup",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="counterrollup",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "counter",
+                    "day",
+                    "model",
+                    "os_name",
+                    "os_version",
+                    "app_version",
+                    "build_number",
+                ),
+                name="unique_counter_rollup",
+            ),
+        ),
+    ]
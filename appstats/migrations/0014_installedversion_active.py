@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-17 16:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def copy_from_install(apps, schema_editor):
+    Install = apps.get_model("appstats", "Install")
+    InstalledVersion = apps.get_model("appstats", "InstalledVersion")
+    db_alias = schema_editor.connection.alias
+    install = Install.objects.using(db_alias).filter(pk=models.OuterRef("install"))
+    InstalledVersion.objects.using(db_alias).update(
+        app=models.Subquery(install.values("app")[:1]),
+        last_seen=models.Subquery(install.values("date_updated")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0013_rollups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="installedversion",
+            name="app",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="installed_versions",
+                to="appstats.app",
+            ),
+        ),
+        migrations.AddField(
+            model_name="installedversion",
+            name="last_seen",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_from_install, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="installedversion",
+            name="app",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="installed_versions",
+                to="appstats.app",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="installedversion",
+            index=models.Index(
+                fields=["app", "latest", "last_seen"], name="installedversion_active"
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0014_installedversion_active"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GaugeSketchBin",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("sign", models.SmallIntegerField()),
+                ("index", models.IntegerField()),
+                ("count", models.BigIntegerField(default=0)),
+                (
+                    "gauge",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sketch_bins",
+                        to="appstats.gauge",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="gaugesketchbin",
+            constraint=models.UniqueConstraint(
+                fields=("gauge", "day", "sign", "index"), name="unique_gauge_sketch_bin"
+            ),
+        ),
+    ]
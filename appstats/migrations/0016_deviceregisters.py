@@ -0,0 +1,152 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0015_gaugesketchbin"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CounterDeviceRegister",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("model", models.CharField(max_length=255)),
+                ("os_name", models.CharField(max_length=255)),
+                ("os_version", models.CharField(max_length=255)),
+                ("app_version", models.CharField(max_length=255)),
+                ("build_number", models.CharField(max_length=255)),
+                ("register", models.IntegerField()),
+                ("rank", models.SmallIntegerField(default=0)),
+                (
+                    "counter",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="device_registers",
+                        to="appstats.counter",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="GaugeDeviceRegister",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("model", models.CharField(max_length=255)),
+                ("os_name", models.CharField(max_length=255)),
+                ("os_version", models.CharField(max_length=255)),
+                ("app_version", models.CharField(max_length=255)),
+                ("build_number", models.CharField(max_length=255)),
+                ("register", models.IntegerField()),
+                ("rank", models.SmallIntegerField(default=0)),
+                (
+                    "gauge",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="device_registers",
+                        to="appstats.gauge",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="EventDeviceRegister",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("model", models.CharField(max_length=255)),
+                ("os_name", models.CharField(max_length=255)),
+                ("os_version", models.CharField(max_length=255)),
+                ("app_version", models.CharField(max_length=255)),
+                ("build_number", models.CharField(max_length=255)),
+                ("register", models.IntegerField()),
+                ("rank", models.SmallIntegerField(default=0)),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="device_registers",
+                        to="appstats.event",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="counterdeviceregister",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "counter",
+                    "day",
+                    "model",
+                    "os_name",
+                    "os_version",
+                    "app_version",
+                    "build_number",
+                    "register",
+                ),
+                name="unique_counter_device_register",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="gaugedeviceregister",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "gauge",
+                    "day",
+                    "model",
+                    "os_name",
+                    "os_version",
+                    "app_version",
+                    "build_number",
+                    "register",
+                ),
+                name="unique_gauge_device_register",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="eventdeviceregister",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "event",
+                    "day",
+                    "model",
+                    "os_name",
+                    "os_version",
+                    "app_version",
+                    "build_number",
+                    "register",
+                ),
+                name="unique_event_device_register",
+            ),
+        ),
+    ]
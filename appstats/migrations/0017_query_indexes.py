@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0016_deviceregisters"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="install",
+            index=models.Index(fields=["app", "date_updated"], name="install_active"),
+        ),
+        migrations.AddIndex(
+            model_name="installedversion",
+            index=models.Index(
+                condition=models.Q(("latest", True)),
+                fields=["install"],
+                name="installedversion_latest",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="gaugeinstance",
+            index=models.Index(
+                fields=["gauge", "date_created"], name="gaugeinstance_gauge_date"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="eventinstance",
+            index=models.Index(
+                fields=["event", "date_created"], name="eventinstance_event_date"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0017_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="app",
+            name="event_retention_days",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="app",
+            name="gauge_retention_days",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0018_app_retention"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GaugeSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket", models.DateTimeField()),
+                ("count", models.BigIntegerField()),
+                ("sum", models.FloatField()),
+                ("min", models.FloatField()),
+                ("max", models.FloatField()),
+                ("sketch", models.JSONField(default=list)),
+                (
+                    "gauge",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="summaries",
+                        to="appstats.gauge",
+                    ),
+                ),
+                (
+                    "version",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="gauge_summaries",
+                        to="appstats.installedversion",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["gauge", "bucket"], name="gaugesummary_gauge_bucket"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="gaugesummary",
+            constraint=models.UniqueConstraint(
+                fields=("gauge", "version", "bucket"), name="unique_gauge_summary"
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:18
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("appstats", "0019_gaugesummary"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="install",
+            name="install_active",
+        ),
+    ]
@@ -1,7 +1,17 @@
 import datetime
 
-from django.db import models
+import functools
+import math
+import operator
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.functions import Greatest, Trunc
 from django.utils import timezone
+from django.utils.timezone import make_aware
+
+from .cache import aggregate_cache, cached_aggregate
+from .sketches import DDSketch, HyperLogLog
 
 
 DEVICE_SCHEMA = {
@@ -84,37 +94,231 @@ EVENTS_SCHEMA = {
     "required": ["events", "device"],
 }
 
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "counters": {"type": "array", "items": COUNTER_SCHEMA},
+        "gauges": {"type": "array", "items": GAUGE_SCHEMA},
+        "events": {"type": "array", "items": EVENT_SCHEMA},
+        "device": DEVICE_SCHEMA,
+    },
+    "required": ["device"],
+}
+
+
+ACTIVE_WINDOW = datetime.timedelta(days=60)
+
+ROLLUP_DIMENSIONS = ("model", "os_name", "os_version", "app_version", "build_number")
+
+# Relative accuracy of the gauge quantile sketches. Stored bins are only
+# meaningful at the accuracy they were built with, so changing this needs a
+# `rebuild_rollups --kind gauges`.
+GAUGE_SKETCH_ACCURACY = 0.01
+
+# Where the columns of raw metric exports that are not instance fields come from.
+EXPORT_FIELD_PATHS = {"device_id": "install__device_id", **{x: f"version__{x}" for x in ROLLUP_DIMENSIONS}}
+
+# The same for exports of gauge summaries, which only link to the version.
+SUMMARY_EXPORT_FIELD_PATHS = {**EXPORT_FIELD_PATHS, "device_id": "version__install__device_id"}
+
+SERIES_INTERVALS = {"minute": 60, "hour": 60 * 60, "day": 24 * 60 * 60}
+
+# Keys matched per UPDATE when applying increments. Each key adds a branch
+# to an OR in the WHERE clause and a WHEN to a CASE, and SQLite rejects
+# expression trees more than 1000 levels deep.
+UPDATE_CHUNK_SIZE = 200
+
+
+def chunked(items, size=UPDATE_CHUNK_SIZE):
+    """Split a list into lists of at most `size` items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def day_range(start, end):
+    """Return the first day of [start, end) and the first day after it, in local time."""
+    end_day = timezone.localdate(end)
+    if timezone.localtime(end).time() != datetime.time.min:
+        end_day += datetime.timedelta(days=1)
+    return timezone.localdate(start), end_day
+
+
+def from_timestamp(timestamp):
+    return make_aware(datetime.datetime.fromtimestamp(timestamp))
+
+
+def update_rollups(rollup_model, metric_field, version, increments):
+    """Add to the daily rollups of a version's dimensions.
+
+    `increments` maps (metric ID, day) to the amount to add. Missing rows are
+    created first so that each UPDATE can apply its increments atomically.
+    """
+    if not increments:
+        return
+    dimensions = {x: getattr(version, x) for x in ROLLUP_DIMENSIONS}
+    rollup_model.objects.bulk_create([
+        rollup_model(**{f"{metric_field}_id": metric_id, "day": day}, **dimensions)
+        for metric_id, day in increments
+    ], ignore_conflicts=True)
+    for chunk in chunked(list(increments.items())):
+        keys = [(models.Q(**{f"{metric_field}_id": metric_id, "day": day}), amount) for (metric_id, day), amount in chunk]
+        rollup_model.objects.filter(functools.reduce(operator.or_, [key for key, amount in keys]), **dimensions).update(
+            total=models.F("total") + models.Case(
+                *[models.When(key, then=amount) for key, amount in keys],
+                default=0,
+                output_field=models.BigIntegerField(),
+            ),
+        )
+
+
+def unique_devices_precision():
+    """The HyperLogLog precision that gives the configured error for unique device counts."""
+    return HyperLogLog.precision_for_error(getattr(settings, "APPSTATS_UNIQUE_DEVICES_ERROR", 0.02))
+
+
+def update_device_registers(register_model, metric_field, version, device_id, keys):
+    """Add a device to the HyperLogLog registers of a version's dimensions.
+
+    `keys` holds the (metric ID, day) pairs the device reported. A device
+    only ever touches one register, so each UPDATE raises it to the
+    device's rank for every metric and day in a chunk of keys.
+    """
+    if not keys:
+        return
+    register, rank = HyperLogLog(unique_devices_precision()).register(device_id)
+    dimensions = {x: getattr(version, x) for x in ROLLUP_DIMENSIONS}
+    register_model.objects.bulk_create([
+        register_model(**{f"{metric_field}_id": metric_id, "day": day, "register": register}, **dimensions)
+        for metric_id, day in keys
+    ], ignore_conflicts=True)
+    for chunk in chunked(list(keys)):
+        register_model.objects.filter(
+            functools.reduce(operator.or_, [models.Q(**{f"{metric_field}_id": metric_id, "day": day}) for metric_id, day in chunk]),
+            register=register,
+            **dimensions,
+        ).update(rank=Greatest("rank", rank))
+
+
+def update_sketch_bins(increments):
+    """Add to the counts of gauge sketch bins.
+
+    `increments` maps (gauge ID, day, sign, index) to the number of readings
+    to add, and is applied the same way as update_rollups.
+    """
+    if not increments:
+        return
+    fields = ("gauge_id", "day", "sign", "index")
+    GaugeSketchBin.objects.bulk_create([
+        GaugeSketchBin(**dict(zip(fields, key))) for key in increments
+    ], ignore_conflicts=True)
+    for chunk in chunked(list(increments.items())):
+        keys = [(models.Q(**dict(zip(fields, key))), amount) for key, amount in chunk]
+        GaugeSketchBin.objects.filter(functools.reduce(operator.or_, [key for key, amount in keys])).update(
+            count=models.F("count") + models.Case(
+                *[models.When(key, then=amount) for key, amount in keys],
+                default=0,
+                output_field=models.BigIntegerField(),
+            ),
+        )
+
 
 class App(models.Model):
     name = models.CharField(max_length=255, unique=True)
     slug = models.SlugField(unique=True)
     key = models.CharField(max_length=255)
+    # Days of raw gauge readings and events to keep, enforced by
+    # `manage.py apply_retention`. When blank, APPSTATS_RETENTION_DAYS
+    # applies, and if that is None they are kept forever.
+    gauge_retention_days = models.PositiveIntegerField(null=True, blank=True)
+    event_retention_days = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.name
 
-    def active_installs(self):
-        return self.installs.filter(date_updated__gte=timezone.now() - datetime.timedelta(days=60))
+    def retention_cutoff(self, kind):
+        """Return the time before which raw readings of a kind ("gauges" or "events") may be deleted, or None."""
+        days = getattr(self, f"{kind[:-1]}_retention_days")
+        if days is None:
+            days = getattr(settings, "APPSTATS_RETENTION_DAYS", None)
+        if days is None:
+            return None
+        return timezone.now() - datetime.timedelta(days=days)
 
     def active_install_versions(self):
-        return InstalledVersion.objects.filter(install__in=self.active_installs(), latest=True)
+        """The latest version of every install seen within the active window."""
+        return self.installed_versions.filter(latest=True, last_seen__gte=timezone.now() - ACTIVE_WINDOW)
+
+    def active_installs(self):
+        return self.installs.filter(pk__in=self.active_install_versions().values("install"))
+
+    @cached_aggregate
+    def active_install_count(self):
+        # Each install has one latest version, so this counts the same
+        # installs as active_installs_by_parameter() and the navigation bar.
+        return self.active_install_versions().count()
+
+    @cached_aggregate
+    def metric_totals(self):
+        """Return the active totals of every counter, gauge and event, keyed by kind and then metric ID."""
+        since = timezone.localdate() - ACTIVE_WINDOW
+        return {
+            kind: dict(
+                rollup_model.objects.filter(**{f"{field}__app": self, "day__gte": since})
+                .values_list(field)
+                .annotate(total=models.Sum("total"))
+                .order_by()
+            )
+            for kind, rollup_model, field in (
+                ("counters", CounterRollup, "counter"),
+                ("gauges", GaugeRollup, "gauge"),
+                ("events", EventRollup, "event"),
+            )
+        }
 
     def active_installs_by_parameter(self, *parameters):
         return self.active_install_versions().values(*parameters).annotate(total=models.Count("install")).order_by("-total")
 
+    @cached_aggregate
     def active_count_per_model(self):
         return {x["model"]: x["total"] for x in self.active_installs_by_parameter("model")}
 
+    @cached_aggregate
     def active_count_per_os_name(self):
         return {x["os_name"]: x["total"] for x in self.active_installs_by_parameter("os_name")}
 
+    @cached_aggregate
     def active_count_per_os_version(self):
         return {(x["os_name"], x["os_version"]): x["total"] for x in self.active_installs_by_parameter("os_name", "os_version")}
 
+    @cached_aggregate
     def active_count_per_app_version(self):
         return {(x["app_version"], x["build_number"]): x["total"] for x in self.active_installs_by_parameter("app_version", "build_number")}
 
     def register_instance(self, device_id, model, app_version, build_number, os_name, os_version, os_version_string, **kwargs):
+        from .activity import last_seen
+        from .cache import device_cache
+
+        fingerprint = (model, app_version, build_number, os_name, os_version, os_version_string)
+        cached = device_cache.get(self.pk, device_id, fingerprint)
+        if cached is not None:
+            install_id, version_id = cached
+            install = Install(pk=install_id, app=self, device_id=device_id)
+            install._state.adding = False
+            version = InstalledVersion(
+                pk=version_id,
+                app=self,
+                install=install,
+                model=model,
+                app_version=app_version,
+                build_number=build_number,
+                os_name=os_name,
+                os_version=os_version,
+                os_version_string=os_version_string,
+                latest=True,
+            )
+            version._state.adding = False
+            transaction.on_commit(lambda: last_seen.touch(install_id))
+            return (install, version)
+
         install, _created = self.installs.get_or_create(
             device_id=device_id,
         )
@@ -125,81 +329,343 @@ class App(models.Model):
             os_name=os_name,
             os_version=os_version,
             os_version_string=os_version_string,
+            defaults={"app": self},
         )
         version.latest = True
+        version.last_seen = timezone.now()
         version.save()
         install.versions.exclude(pk=version.pk).update(latest=False)
+        transaction.on_commit(lambda: device_cache.set(self.pk, device_id, fingerprint, install.pk, version.pk))
+        transaction.on_commit(lambda: last_seen.touch(install.pk, install.date_updated))
         return (install, version)
 
     def register_counter(self, name, count, date_created, date_updated, **kwargs):
-        install, version = self.register_instance(**kwargs)
-        counter, _created = self.counters.get_or_create(name=name)
-        counter_instance, _created = counter.instances.get_or_create(
-            install=install,
-            version=version,
-            defaults={
-                "date_created": date_created,
-                "date_updated": date_updated,
-            })
-        counter_instance.count += count
-        if date_updated > counter_instance.date_updated:
-            counter_instance.date_updated = date_updated
-        counter_instance.save()
-        return counter_instance
+        return self.register_counters([{
+            "name": name,
+            "count": count,
+            "date_created": date_created,
+            "date_updated": date_updated,
+        }], **kwargs)[0]
 
     def register_gauge(self, name, value, date_created=None, **kwargs):
-        install, version = self.register_instance(**kwargs)
-        gauge, _created = self.gauges.get_or_create(name=name)
-        gauge_instance = GaugeInstance(
-            gauge=gauge,
-            install=install,
-            version=version,
-            value=value,
-            date_created=date_created,
-        )
-        gauge_instance.save()
-        return gauge_instance
+        return self.register_gauges([{
+            "name": name,
+            "value": value,
+            "date_created": date_created,
+        }], **kwargs)[0]
 
     def register_event(self, name, attributes, date_created=None, **kwargs):
-        install, version = self.register_instance(**kwargs)
-        event, _created = self.events.get_or_create(name=name)
-        event_instance = EventInstance(
-            event=event,
+        return self.register_events([{
+            "name": name,
+            "attributes": attributes,
+            "date_created": date_created,
+        }], **kwargs)[0]
+
+    def register_counters(self, counters, **kwargs):
+        return self.register_batch(counters=counters, **kwargs)["counters"]
+
+    def register_gauges(self, gauges, **kwargs):
+        return self.register_batch(gauges=gauges, **kwargs)["gauges"]
+
+    def register_events(self, events, **kwargs):
+        return self.register_batch(events=events, **kwargs)["events"]
+
+    def register_batch(self, counters=(), gauges=(), events=(), **kwargs):
+        """Register counters, gauges and events reported by a single device.
+
+        The device is resolved once and everything is written in a single
+        transaction. Metrics and counter instances are fetched with set-based
+        lookups, so the number of queries stays the same however many metrics
+        are in the batch.
+        """
+        results = {"counters": [], "gauges": [], "events": []}
+        if not (counters or gauges or events):
+            return results
+        with transaction.atomic():
+            install, version = self.register_instance(**kwargs)
+            transaction.on_commit(lambda: aggregate_cache.bump(self.pk))
+            if counters:
+                results["counters"] = self._register_counters(install, version, counters)
+            if gauges:
+                results["gauges"] = self._register_gauges(install, version, gauges)
+            if events:
+                results["events"] = self._register_events(install, version, events)
+        return results
+
+    def ingest(self, data):
+        """Register every metric in an API payload that has passed schema validation."""
+        return self.register_batch(
+            counters=[
+                {
+                    "name": counter["name"],
+                    "count": counter["count"],
+                    "date_created": from_timestamp(counter["dateCreated"]),
+                    "date_updated": from_timestamp(counter["dateUpdated"]),
+                }
+                for counter in data.get("counters", ())
+            ],
+            gauges=[
+                {
+                    "name": gauge["name"],
+                    "value": gauge["value"],
+                    "date_created": from_timestamp(gauge["dateCreated"]),
+                }
+                for gauge in data.get("gauges", ())
+            ],
+            events=[
+                {
+                    "name": event["name"],
+                    "attributes": event.get("attributes", {}),
+                    "date_created": from_timestamp(event["dateCreated"]),
+                }
+                for event in data.get("events", ())
+            ],
+            **data["device"],
+        )
+
+    def _get_metrics(self, metric_model, names):
+        """Fetch the metrics of this app with the given names, creating any that are missing."""
+        names = set(names)
+        metrics = {x.name: x for x in metric_model.objects.filter(app=self, name__in=names)}
+        missing = [metric_model(app=self, name=name) for name in names if name not in metrics]
+        if missing:
+            metric_model.objects.bulk_create(missing, ignore_conflicts=True)
+            metrics = {x.name: x for x in metric_model.objects.filter(app=self, name__in=names)}
+        return metrics
+
+    def _register_counters(self, install, version, counters):
+        updates = {}
+        for counter in counters:
+            update = updates.get(counter["name"])
+            if update is None:
+                updates[counter["name"]] = dict(counter)
+            else:
+                update["count"] += counter["count"]
+                update["date_updated"] = max(update["date_updated"], counter["date_updated"])
+
+        metrics = self._get_metrics(Counter, updates)
+
+        # Make sure every instance exists, then apply all the increments in a
+        # single UPDATE so that concurrent uploads cannot lose counts.
+        CounterInstance.objects.bulk_create([
+            CounterInstance(
+                counter=metrics[name],
+                install=install,
+                version=version,
+                count=0,
+                date_created=update["date_created"],
+                date_updated=update["date_updated"],
+            )
+            for name, update in updates.items()
+        ], ignore_conflicts=True)
+        instances = CounterInstance.objects.filter(
+            counter__in=metrics.values(),
             install=install,
             version=version,
-            attributes=attributes,
-            date_created=date_created,
         )
-        event_instance.save()
-        return event_instance
+        instances.update(
+            count=models.F("count") + models.Case(
+                *[models.When(counter=metrics[name], then=update["count"]) for name, update in updates.items()],
+                output_field=models.IntegerField(),
+            ),
+            date_updated=Greatest("date_updated", models.Case(
+                *[models.When(counter=metrics[name], then=models.Value(update["date_updated"])) for name, update in updates.items()],
+                output_field=models.DateTimeField(),
+            )),
+        )
+
+        increments = {}
+        for name, update in updates.items():
+            key = (metrics[name].pk, timezone.localdate(update["date_updated"]))
+            increments[key] = increments.get(key, 0) + update["count"]
+        update_rollups(CounterRollup, "counter", version, increments)
+        update_device_registers(CounterDeviceRegister, "counter", version, install.device_id, increments.keys())
+
+        results = {x.counter_id: x for x in instances}
+        for counter in metrics.values():
+            results[counter.pk].counter = counter
+        return [results[metrics[name].pk] for name in updates]
+
+    def _register_gauges(self, install, version, gauges):
+        metrics = self._get_metrics(Gauge, (x["name"] for x in gauges))
+        instances = GaugeInstance.objects.bulk_create([
+            GaugeInstance(
+                gauge=metrics[gauge["name"]],
+                install=install,
+                version=version,
+                value=gauge["value"],
+                date_created=gauge["date_created"],
+            )
+            for gauge in gauges
+        ])
+        increments = {}
+        for instance in instances:
+            key = (instance.gauge_id, timezone.localdate(instance.date_created))
+            increments[key] = increments.get(key, 0) + 1
+        update_rollups(GaugeRollup, "gauge", version, increments)
+        update_device_registers(GaugeDeviceRegister, "gauge", version, install.device_id, increments.keys())
+
+        sketch = DDSketch(GAUGE_SKETCH_ACCURACY)
+        bins = {}
+        for instance in instances:
+            key = (instance.gauge_id, timezone.localdate(instance.date_created), *sketch.key(instance.value))
+            bins[key] = bins.get(key, 0) + 1
+        update_sketch_bins(bins)
+        return instances
+
+    def _register_events(self, install, version, events):
+        metrics = self._get_metrics(Event, (x["name"] for x in events))
+        instances = EventInstance.objects.bulk_create([
+            EventInstance(
+                event=metrics[event["name"]],
+                install=install,
+                version=version,
+                attributes=event["attributes"],
+                date_created=event["date_created"],
+            )
+            for event in events
+        ])
+        increments = {}
+        for instance in instances:
+            key = (instance.event_id, timezone.localdate(instance.date_created))
+            increments[key] = increments.get(key, 0) + 1
+        update_rollups(EventRollup, "event", version, increments)
+        update_device_registers(EventDeviceRegister, "event", version, install.device_id, increments.keys())
+        return instances
 
 
 class MetricMixin:
 
-    def active_instances(self):
-        return self.instances.filter(
-            install__in=self.app.active_installs()
-        )
+    def active_rollups(self):
+        return self.rollups.filter(day__gte=timezone.localdate() - ACTIVE_WINDOW)
 
+    @cached_aggregate
     def active_count_per_parameter(self, *parameters):
-        active_items = self.active_instances().values_list(*parameters).distinct()
         results = {}
-        for items in active_items:
-            kwargs = {p: i for p, i in zip(parameters, items)}
-            results[items[0] if len(items) == 1 else items] = self._count(self.active_instances().filter(**kwargs))
+        rows = self.active_rollups().values_list(*parameters).annotate(total=models.Sum("total")).order_by()
+        for *items, total in rows:
+            results[items[0] if len(items) == 1 else tuple(items)] = total
         return results
 
     def active_count_per_model(self):
-        return self.active_count_per_parameter("version__model")
+        return self.active_count_per_parameter("model")
 
     def active_count_per_os_name(self):
-        return self.active_count_per_parameter("version__os_name")
+        return self.active_count_per_parameter("os_name")
 
     def active_count_per_os_version(self):
-        return self.active_count_per_parameter("version__os_name", "version__os_version")
+        return self.active_count_per_parameter("os_name", "os_version")
 
     def active_count_per_app_version(self):
-        return self.active_count_per_parameter("version__app_version", "version__build_number")
+        return self.active_count_per_parameter("app_version", "build_number")
+
+    @cached_aggregate
+    def total(self):
+        return self.active_rollups().aggregate(total=models.Sum("total"))["total"] or 0
+
+    def unique_devices(self, start=None, end=None, **filters):
+        """Estimate how many distinct devices reported the metric on the days in [start, end).
+
+        `filters` restrict the devices by any of ROLLUP_DIMENSIONS. The
+        registers are merged in the database, so this costs the same however
+        many readings or devices there are.
+        """
+        registers = self.device_registers.filter(**filters)
+        if start is not None:
+            registers = registers.filter(day__gte=start)
+        if end is not None:
+            registers = registers.filter(day__lt=end)
+        rows = registers.values_list("register").annotate(rank=models.Max("rank")).order_by()
+        return HyperLogLog(unique_devices_precision(), rows).count()
+
+    @cached_aggregate
+    def active_unique_devices(self):
+        return self.unique_devices(start=timezone.localdate() - ACTIVE_WINDOW)
+
+    def series(self, start, end, interval="hour", max_points=None, **filters):
+        """Return the metric's values in time buckets between `start` and `end`.
+
+        `filters` restrict the devices by any of ROLLUP_DIMENSIONS. If the
+        range holds more than `max_points` buckets of `interval`, buckets are
+        widened to a multiple of it. Each point is a dict with the bucket's
+        start as a Unix timestamp in "t" and its aggregates.
+        """
+        if interval not in self.series_intervals:
+            raise ValueError(f"{type(self).__name__} series support intervals of {', '.join(self.series_intervals)}.")
+        width = SERIES_INTERVALS[interval]
+        buckets = math.ceil((end - start).total_seconds() / width)
+        if max_points and buckets > max_points:
+            width *= math.ceil(buckets / max_points)
+            # Round up to a multiple of the coarsest interval that fits, so
+            # the database can be queried at that resolution.
+            coarsest = max(SERIES_INTERVALS[x] for x in self.series_intervals if SERIES_INTERVALS[interval] <= SERIES_INTERVALS[x] <= width)
+            width = math.ceil(width / coarsest) * coarsest
+        # Query at the coarsest resolution that still divides the buckets,
+        # so the database returns as few rows as possible.
+        unit = max(
+            (x for x in self.series_intervals if SERIES_INTERVALS[interval] <= SERIES_INTERVALS[x] <= width and width % SERIES_INTERVALS[x] == 0),
+            key=SERIES_INTERVALS.get,
+        )
+
+        points = {}
+        for bucket, values in self._series_rows(start, end, unit, filters):
+            t = int(bucket.timestamp()) // width * width
+            point = points.get(t)
+            if point is None:
+                points[t] = dict(values)
+                continue
+            for key, value in values.items():
+                if key == "min":
+                    point[key] = min(point[key], value)
+                elif key == "max":
+                    point[key] = max(point[key], value)
+                else:
+                    point[key] += value
+        return width, [self._series_point(t, points[t]) for t in sorted(points)]
+
+    def _rollup_series_rows(self, start, end, filters):
+        start_day, end_day = day_range(start, end)
+        rows = self.rollups.filter(day__gte=start_day, day__lt=end_day, **filters)
+        for day, value in rows.values_list("day").annotate(value=models.Sum("total")).order_by():
+            yield make_aware(datetime.datetime.combine(day, datetime.time.min)), {"value": value}
+
+    def _instance_series_rows(self, start, end, unit, filters, **aggregates):
+        rows = (
+            self.instances.filter(
+                date_created__gte=start,
+                date_created__lt=end,
+                **{f"version__{key}": value for key, value in filters.items()},
+            )
+            .annotate(bucket=Trunc("date_created", unit))
+            .values("bucket")
+            .annotate(**aggregates)
+            .order_by()
+        )
+        for row in rows:
+            yield row.pop("bucket"), row
+
+    def _series_point(self, t, values):
+        return {"t": t, **values}
+
+    def export_rows(self, start=None, end=None, chunk_size=2000):
+        """Yield the metric's raw instances as tuples of `export_fields`.
+
+        Rows are ordered, and limited by `start` and `end`, on the first
+        field. The device and version dimensions are joined in the same
+        query, and rows are fetched `chunk_size` at a time, so memory use
+        stays constant however many rows there are.
+        """
+        return self._export_rows(self.instances, self.export_fields, EXPORT_FIELD_PATHS, start, end, chunk_size)
+
+    def _export_rows(self, rows, export_fields, paths, start, end, chunk_size):
+        date_field = export_fields[0]
+        rows = rows.order_by(date_field, "pk")
+        if start is not None:
+            rows = rows.filter(**{f"{date_field}__gte": start})
+        if end is not None:
+            rows = rows.filter(**{f"{date_field}__lt": end})
+        fields = [paths.get(x, x) for x in export_fields]
+        return rows.values_list(*fields).iterator(chunk_size=chunk_size)
 
 
 class Counter(MetricMixin, models.Model):
@@ -212,11 +678,16 @@ class Counter(MetricMixin, models.Model):
     class Meta:
         unique_together = (("name", "app",))
 
-    def _count(self, queryset):
-        return queryset.aggregate(models.Sum("count"))["count__sum"]
+    # Counter instances only hold a running total, so their history comes
+    # from the daily rollups.
+    series_intervals = ("day",)
+    export_fields = ("date_updated", "date_created", "count", "device_id", *ROLLUP_DIMENSIONS)
 
-    def total(self):
-        return self.active_instances().aggregate(models.Sum("count"))["count__sum"]
+    def _aggregate(self):
+        return models.Sum("count")
+
+    def _series_rows(self, start, end, unit, filters):
+        return self._rollup_series_rows(start, end, filters)
 
 
 class Gauge(MetricMixin, models.Model):
@@ -229,11 +700,81 @@ class Gauge(MetricMixin, models.Model):
     class Meta:
         unique_together = (("name", "app",))
 
-    def _count(self, queryset):
-        return queryset.count()
+    series_intervals = ("minute", "hour", "day")
+    export_fields = ("date_created", "value", "device_id", *ROLLUP_DIMENSIONS)
+    summary_export_fields = ("bucket", "count", "sum", "min", "max", "sketch", "device_id", *ROLLUP_DIMENSIONS)
 
-    def total(self):
-        return self.instances.filter(install__in=self.app.active_installs()).count()
+    def _aggregate(self):
+        return models.Count("id")
+
+    def _series_rows(self, start, end, unit, filters):
+        yield from self._instance_series_rows(
+            start, end, unit, filters,
+            count=models.Count("id"),
+            sum=models.Sum("value"),
+            min=models.Min("value"),
+            max=models.Max("value"),
+        )
+        # Readings compacted by `manage.py compact_gauges` are counted in the
+        # bucket their summary starts in.
+        rows = (
+            self.summaries.filter(
+                bucket__gte=start,
+                bucket__lt=end,
+                **{f"version__{key}": value for key, value in filters.items()},
+            )
+            .annotate(series_bucket=Trunc("bucket", unit))
+            .values("series_bucket")
+            .annotate(
+                count=models.Sum("count"),
+                sum=models.Sum("sum"),
+                min=models.Min("min"),
+                max=models.Max("max"),
+            )
+            .order_by()
+        )
+        for row in rows:
+            yield row.pop("series_bucket"), row
+
+    def export_summary_rows(self, start=None, end=None, chunk_size=2000):
+        """Yield the readings compacted by `manage.py compact_gauges` as tuples of `summary_export_fields`.
+
+        These readings are no longer in export_rows(). Rows are ordered and
+        limited by bucket, and fetched the same way.
+        """
+        return self._export_rows(self.summaries, self.summary_export_fields, SUMMARY_EXPORT_FIELD_PATHS, start, end, chunk_size)
+
+    def sketch(self, start=None, end=None):
+        """Return a DDSketch of the readings between two days, inclusive.
+
+        The stored bins are merged in the database, so this costs the same
+        however many readings there are.
+        """
+        bins = self.sketch_bins.all()
+        if start is not None:
+            bins = bins.filter(day__gte=start)
+        if end is not None:
+            bins = bins.filter(day__lte=end)
+        rows = bins.values_list("sign", "index").annotate(total=models.Sum("count")).order_by()
+        return DDSketch(GAUGE_SKETCH_ACCURACY, (((sign, index), total) for sign, index, total in rows))
+
+    @cached_aggregate
+    def active_distribution(self):
+        """Return the percentiles and a histogram of the readings in the active window."""
+        sketch = self.sketch(start=timezone.localdate() - ACTIVE_WINDOW)
+        return {
+            "percentiles": {f"p{round(q * 100)}": sketch.quantile(q) for q in (0.5, 0.9, 0.95, 0.99)},
+            "histogram": sketch.histogram(),
+        }
+
+    def _series_point(self, t, values):
+        return {
+            "t": t,
+            "value": values["count"],
+            "min": values["min"],
+            "max": values["max"],
+            "mean": values["sum"] / values["count"],
+        }
 
 
 class Event(MetricMixin, models.Model):
@@ -246,11 +787,16 @@ class Event(MetricMixin, models.Model):
     class Meta:
         unique_together = (("name", "app",))
 
-    def _count(self, queryset):
-        return queryset.count()
+    series_intervals = ("minute", "hour", "day")
+    export_fields = ("date_created", "attributes", "device_id", *ROLLUP_DIMENSIONS)
 
-    def total(self):
-        return self.instances.filter(install__in=self.app.active_installs()).count()
+    def _aggregate(self):
+        return models.Count("id")
+
+    def _series_rows(self, start, end, unit, filters):
+        if unit == "day":
+            return self._rollup_series_rows(start, end, filters)
+        return self._instance_series_rows(start, end, unit, filters, value=models.Count("id"))
 
 
 class Install(models.Model):
@@ -264,6 +810,7 @@ class Install(models.Model):
 
 
 class InstalledVersion(models.Model):
+    app = models.ForeignKey(App, related_name="installed_versions", on_delete=models.CASCADE)
     install = models.ForeignKey(Install, related_name="versions", on_delete=models.CASCADE)
     model = models.CharField(max_length=255)
     app_version = models.CharField(max_length=255)
@@ -273,10 +820,19 @@ class InstalledVersion(models.Model):
     os_version_string = models.CharField(max_length=255)
     date_created = models.DateTimeField(auto_now_add=True)
     latest = models.BooleanField(default=True)
+    # Copied from the install while this is its latest version, so the
+    # active versions of an app can be found with one index range scan.
+    last_seen = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return f"{self.install.app.name}: Install {self.install.device_id} ({self.model}) - Version {self.app_version} ({self.build_number}) on {self.os_name} {self.os_version}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["app", "latest", "last_seen"], name="installedversion_active"),
+            models.Index(fields=["install"], condition=models.Q(latest=True), name="installedversion_latest"),
+        ]
+
 
 class CounterInstance(models.Model):
     counter = models.ForeignKey(Counter, related_name="instances", on_delete=models.CASCADE)
@@ -289,6 +845,11 @@ class CounterInstance(models.Model):
     def __str__(self):
         return f"{self.counter.app.name}: Install {self.install.device_id}: Counter {self.counter.name}: {self.count}"
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["counter", "install", "version"], name="unique_counter_instance"),
+        ]
+
 
 class GaugeInstance(models.Model):
     gauge = models.ForeignKey(Gauge, related_name="instances", on_delete=models.CASCADE)
@@ -300,6 +861,11 @@ class GaugeInstance(models.Model):
     def __str__(self):
         return f"{self.gauge.app.name}: Install {self.install.device_id}: Gauge {self.gauge.name}: {self.date_created}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["gauge", "date_created"], name="gaugeinstance_gauge_date"),
+        ]
+
 
 class EventInstance(models.Model):
     event = models.ForeignKey(Event, related_name="instances", on_delete=models.CASCADE)
@@ -310,3 +876,170 @@ class EventInstance(models.Model):
 
     def __str__(self):
         return f"{self.event.app.name}: Install {self.install.device_id}: Event {self.event.name}: {self.date_created}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["event", "date_created"], name="eventinstance_event_date"),
+        ]
+
+
+class Rollup(models.Model):
+    """Daily totals of a metric for one combination of device dimensions.
+
+    For counters the total is the sum of the increments reported that day;
+    for gauges and events it is the number of readings.
+    """
+    day = models.DateField()
+    model = models.CharField(max_length=255)
+    os_name = models.CharField(max_length=255)
+    os_version = models.CharField(max_length=255)
+    app_version = models.CharField(max_length=255)
+    build_number = models.CharField(max_length=255)
+    total = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class CounterRollup(Rollup):
+    counter = models.ForeignKey(Counter, related_name="rollups", on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.counter.app.name}: Counter {self.counter.name}: {self.day}: {self.total}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["counter", "day", *ROLLUP_DIMENSIONS], name="unique_counter_rollup"),
+        ]
+
+
+class GaugeRollup(Rollup):
+    gauge = models.ForeignKey(Gauge, related_name="rollups", on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.gauge.app.name}: Gauge {self.gauge.name}: {self.day}: {self.total}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["gauge", "day", *ROLLUP_DIMENSIONS], name="unique_gauge_rollup"),
+        ]
+
+
+class EventRollup(Rollup):
+    event = models.ForeignKey(Event, related_name="rollups", on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.event.app.name}: Event {self.event.name}: {self.day}: {self.total}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["event", "day", *ROLLUP_DIMENSIONS], name="unique_event_rollup"),
+        ]
+
+
+class GaugeSummary(models.Model):
+    """Readings of a gauge from one installed version, compacted into a time bucket.
+
+    `sketch` holds the DDSketch bins of the readings as [sign, index, count]
+    lists, at GAUGE_SKETCH_ACCURACY.
+    """
+    gauge = models.ForeignKey(Gauge, related_name="summaries", on_delete=models.CASCADE)
+    version = models.ForeignKey(InstalledVersion, related_name="gauge_summaries", on_delete=models.CASCADE)
+    bucket = models.DateTimeField()
+    count = models.BigIntegerField()
+    sum = models.FloatField()
+    min = models.FloatField()
+    max = models.FloatField()
+    sketch = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"{self.gauge.app.name}: Gauge {self.gauge.name}: {self.bucket}: {self.count} readings"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["gauge", "version", "bucket"], name="unique_gauge_summary"),
+        ]
+        indexes = [
+            models.Index(fields=["gauge", "bucket"], name="gaugesummary_gauge_bucket"),
+        ]
+
+
+class DeviceRegister(models.Model):
+    """One HyperLogLog register of the devices that reported a metric on a day.
+
+    Registers are kept per combination of device dimensions, and only
+    registers that some device has reached are stored.
+    """
+    day = models.DateField()
+    model = models.CharField(max_length=255)
+    os_name = models.CharField(max_length=255)
+    os_version = models.CharField(max_length=255)
+    app_version = models.CharField(max_length=255)
+    build_number = models.CharField(max_length=255)
+    register = models.IntegerField()
+    rank = models.SmallIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class CounterDeviceRegister(DeviceRegister):
+    counter = models.ForeignKey(Counter, related_name="device_registers", on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.counter.app.name}: Counter {self.counter.name}: {self.day}: Register {self.register}: {self.rank}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["counter", "day", *ROLLUP_DIMENSIONS, "register"], name="unique_counter_device_register"),
+        ]
+
+
+class GaugeDeviceRegister(DeviceRegister):
+    gauge = models.ForeignKey(Gauge, related_name="device_registers", on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.gauge.app.name}: Gauge {self.gauge.name}: {self.day}: Register {self.register}: {self.rank}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["gauge", "day", *ROLLUP_DIMENSIONS, "register"], name="unique_gauge_device_register"),
+        ]
+
+
+class EventDeviceRegister(DeviceRegister):
+    event = models.ForeignKey(Event, related_name="device_registers", on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.event.app.name}: Event {self.event.name}: {self.day}: Register {self.register}: {self.rank}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["event", "day", *ROLLUP_DIMENSIONS, "register"], name="unique_event_device_register"),
+        ]
+
+
+class GaugeSketchBin(models.Model):
+    """The number of readings of a gauge on one day that fall in one DDSketch bin."""
+    gauge = models.ForeignKey(Gauge, related_name="sketch_bins", on_delete=models.CASCADE)
+    day = models.DateField()
+    sign = models.SmallIntegerField()
+    index = models.IntegerField()
+    count = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.gauge.app.name}: Gauge {self.gauge.name}: {self.day}: Bin ({self.sign}, {self.index}): {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["gauge", "day", "sign", "index"], name="unique_gauge_sketch_bin"),
+        ]
+
+
+class SpoolCheckpoint(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Spool {self.name}: {self.last_id}"
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import app_cache, device_cache, navigation_cache
+from .models import App, Install, InstalledVersion
+
+
+@receiver(post_save, sender=App)
+@receiver(post_delete, sender=App)
+def invalidate_app(sender, instance, **kwargs):
+    app_cache.invalidate()
+    navigation_cache.invalidate()
+
+
+@receiver(post_delete, sender=Install)
+def invalidate_install(sender, instance, **kwargs):
+    device_cache.invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=InstalledVersion)
+def invalidate_installed_version(sender, instance, **kwargs):
+    device_cache.invalidate(instance.install_id)
@@ -0,0 +1,177 @@
+import hashlib
+import math
+
+
+# Values closer to zero than this are counted in the zero bin.
+MIN_INDEXABLE_VALUE = 1e-9
+
+
+class DDSketch:
+    """A mergeable quantile sketch with a bounded relative error.
+
+    Values are counted in logarithmically sized bins, so every quantile is
+    returned within `relative_accuracy` of a value that was actually added,
+    and the number of bins grows with the range of the values rather than
+    with how many there are. Bins are keyed by (sign, index) with a sign of
+    -1, 0 or 1, which is also how they are stored in GaugeSketchBin.
+    Sketches can only be merged if they have the same relative accuracy.
+    """
+
+    def __init__(self, relative_accuracy=0.01, bins=None):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1.")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        for key, count in bins or ():
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    def key(self, value):
+        """Return the bin that `value` is counted in."""
+        if abs(value) < MIN_INDEXABLE_VALUE:
+            return (0, 0)
+        return (1 if value > 0 else -1, math.ceil(math.log(abs(value)) / self._log_gamma))
+
+    def value(self, key):
+        """Return the value that represents every value in a bin."""
+        sign, index = key
+        if sign == 0:
+            return 0.0
+        return sign * 2 * self.gamma ** index / (self.gamma + 1)
+
+    def bounds(self, key):
+        """Return the lowest and highest values counted in a bin."""
+        sign, index = key
+        if sign == 0:
+            return (0.0, 0.0)
+        low, high = self.gamma ** (index - 1), self.gamma ** index
+        return (low, high) if sign > 0 else (-high, -low)
+
+    def add(self, value, count=1):
+        key = self.key(value)
+        self.bins[key] = self.bins.get(key, 0) + count
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only sketches with the same relative accuracy can be merged.")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    @property
+    def count(self):
+        return sum(self.bins.values())
+
+    def to_list(self):
+        """Return the bins as [sign, index, count] lists, for storing as JSON."""
+        return [[sign, index, count] for (sign, index), count in self.sorted_bins()]
+
+    @classmethod
+    def from_list(cls, relative_accuracy, bins):
+        return cls(relative_accuracy, (((sign, index), count) for sign, index, count in bins))
+
+    def sorted_bins(self):
+        """Return the (key, count) pairs of the non-empty bins, lowest values first."""
+        return sorted(
+            ((key, count) for key, count in self.bins.items() if count),
+            key=lambda x: (x[0][0], x[0][0] * x[0][1]),
+        )
+
+    def quantile(self, q):
+        """Return the estimated value at quantile `q`, or None if the sketch is empty."""
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1.")
+        bins = self.sorted_bins()
+        total = sum(count for key, count in bins)
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for key, count in bins:
+            seen += count
+            if seen > rank:
+                return self.value(key)
+        return self.value(bins[-1][0])
+
+    def histogram(self, buckets=20):
+        """Return up to `buckets` (low, high, count) tuples covering the sketch.
+
+        Neighbouring bins are combined so that each bucket spans roughly the
+        same number of bins.
+        """
+        bins = self.sorted_bins()
+        size = max(1, math.ceil(len(bins) / buckets))
+        histogram = []
+        for i in range(0, len(bins), size):
+            chunk = bins[i:i + size]
+            histogram.append((
+                self.bounds(chunk[0][0])[0],
+                self.bounds(chunk[-1][0])[1],
+                sum(count for key, count in chunk),
+            ))
+        return histogram
+
+
+class HyperLogLog:
+    """A mergeable estimate of the number of distinct items seen.
+
+    Each item is hashed to one of 2 ** precision registers, which keeps the
+    largest rank (position of the first set bit) of the hashes it has seen.
+    Registers are merged by taking the maximum, so sketches of different
+    days or dimensions combine into the sketch of their union. The standard
+    error of the estimate is about 1.04 / sqrt(2 ** precision).
+    """
+
+    hash_bits = 64
+
+    def __init__(self, precision=12, registers=None):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18.")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = {}
+        for register, rank in registers or ():
+            self.registers[register] = max(self.registers.get(register, 0), rank)
+
+    @classmethod
+    def precision_for_error(cls, error):
+        """Return the lowest precision whose standard error is at most `error`."""
+        if not 0 < error < 1:
+            raise ValueError("error must be between 0 and 1.")
+        return min(18, max(4, math.ceil(math.log2((1.04 / error) ** 2))))
+
+    def register(self, item):
+        """Return the (register, rank) pair that `item` updates."""
+        digest = hashlib.blake2b(str(item).encode(), digest_size=self.hash_bits // 8).digest()
+        value = int.from_bytes(digest, "big")
+        rest_bits = self.hash_bits - self.precision
+        rest = value & ((1 << rest_bits) - 1)
+        return (value >> rest_bits, rest_bits - rest.bit_length() + 1)
+
+    def add(self, item):
+        register, rank = self.register(item)
+        self.registers[register] = max(self.registers.get(register, 0), rank)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Only sketches with the same precision can be merged.")
+        for register, rank in other.registers.items():
+            self.registers[register] = max(self.registers.get(register, 0), rank)
+
+    def count(self):
+        """Return the estimated number of distinct items."""
+        m = self.size
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        zeros = m - len(self.registers)
+        estimate = alpha * m * m / (zeros + sum(2.0 ** -rank for rank in self.registers.values()))
+        # Linear counting is more accurate while many registers are empty.
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
@@ -0,0 +1,65 @@
+import functools
+import json
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+
+class Spool:
+    """A durable, append-only queue of validated ingest payloads.
+
+    Payloads are stored in their own SQLite database in WAL mode, so
+    appending one never contends with the locks on the main database. IDs
+    are never reused, which lets the drain_spool command record how far it
+    has got in the main database, in the same transaction as the data.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "app_id INTEGER NOT NULL, "
+                "payload TEXT NOT NULL, "
+                "date_created REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def append(self, app_id, data):
+        self.connection.execute(
+            "INSERT INTO spool (app_id, payload, date_created) VALUES (?, ?, ?)",
+            (app_id, json.dumps(data), time.time()),
+        )
+
+    def read(self, after_id, limit):
+        """Return up to `limit` (id, app_id, data) tuples with IDs greater than `after_id`."""
+        rows = self.connection.execute(
+            "SELECT id, app_id, payload FROM spool WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        )
+        return [(id, app_id, json.loads(payload)) for id, app_id, payload in rows]
+
+    def delete_through(self, last_id):
+        self.connection.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+
+@functools.lru_cache(maxsize=None)
+def get_spool():
+    """Return the configured spool, or None if payloads are written synchronously."""
+    path = getattr(settings, "APPSTATS_SPOOL_PATH", None)
+    return Spool(path) if path else None
@@ -0,0 +1,152 @@
+"""Reading compressed and newline-delimited ingest payloads.
+
+An NDJSON upload (Content-Type: application/x-ndjson) is a JSON body split
+into lines. The first line holds the device block and each following line
+holds some of the metrics, in the same shape as the regular body for the
+endpoint, e.g. for /api/events/:
+
+    {"device": {"device_id": "...", ...}}
+    {"events": [{"name": "launch", "dateCreated": 1666000000}]}
+    {"events": [{"name": "launch", "dateCreated": 1666000060}, ...]}
+
+Lines are parsed one at a time and written in chunks of at most
+APPSTATS_INGEST_CHUNK_SIZE metrics, each in its own transaction, so memory
+use does not depend on the size of the upload. Either kind of body may be
+sent with Content-Encoding: gzip.
+"""
+
+import gzip
+import json
+import zlib
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .cache import app_cache
+from .models import DEVICE_SCHEMA
+from .spool import get_spool
+from .validation import compile_schema, validate_payload, ValidationError
+
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson")
+
+KINDS = {
+    "counters": ("counters",),
+    "gauges": ("gauges",),
+    "events": ("events",),
+    "batch": ("counters", "gauges", "events"),
+}
+
+DEVICE_VALIDATOR = compile_schema(DEVICE_SCHEMA)
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def max_size():
+    return settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+
+def open_body(request):
+    """Return a file-like object over the request body, decompressing it if necessary."""
+    encoding = request.headers.get("Content-Encoding", "identity").strip().lower()
+    if encoding in ("", "identity"):
+        return request
+    if encoding in ("gzip", "x-gzip"):
+        return gzip.GzipFile(fileobj=request, mode="rb")
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}.")
+
+
+def read_body(request):
+    """Read the whole (decompressed) body of a regular JSON upload."""
+    if request.headers.get("Content-Encoding", "identity").strip().lower() in ("", "identity"):
+        return request.body
+    limit = max_size()
+    # DATA_UPLOAD_MAX_MEMORY_SIZE = None disables the limit.
+    body = open_body(request).read(-1 if limit is None else limit + 1)
+    if limit is not None and len(body) > limit:
+        raise BodyTooLarge("Decompressed body is too large.")
+    return body
+
+
+def is_ndjson(request):
+    return request.content_type in NDJSON_CONTENT_TYPES
+
+
+def read_lines(stream):
+    limit = max_size() or -1
+    while True:
+        line = stream.readline(limit)
+        if not line:
+            return
+        if limit > 0 and len(line) >= limit and not line.endswith(b"\n"):
+            raise BodyTooLarge("Line is too large.")
+        if line.strip():
+            yield line
+
+
+def read_chunks(stream, kind, chunk_size):
+    """Yield validated payloads of at most `chunk_size` metrics from an NDJSON stream."""
+    lines = read_lines(stream)
+    header = json.loads(next(lines, b"null"))
+    if not isinstance(header, dict) or "device" not in header:
+        raise ValidationError("The first line must contain the device.")
+    device = header["device"]
+    DEVICE_VALIDATOR.validate(device)
+
+    def empty():
+        return {key: [] for key in KINDS[kind]}
+
+    chunk, size = empty(), 0
+    for line in lines:
+        data = json.loads(line)
+        if not isinstance(data, dict):
+            raise ValidationError("Each line must be a JSON object.")
+        data["device"] = device
+        for key in KINDS[kind]:
+            data.setdefault(key, [])
+        validate_payload(data, kind)
+        for key in KINDS[kind]:
+            for item in data[key]:
+                chunk[key].append(item)
+                size += 1
+                if size >= chunk_size:
+                    yield dict(chunk, device=device)
+                    chunk, size = empty(), 0
+    if size:
+        yield dict(chunk, device=device)
+
+
+def ingest_ndjson(request, app_name, kind):
+    """Handle an NDJSON upload to the ingest endpoint for `kind`."""
+    app = app_cache.authenticate(app_name, request.GET.get("key"))
+    if app is None:
+        return JsonResponse({"error": "Invalid app and key."}, status=401)
+
+    spool = get_spool()
+    chunk_size = getattr(settings, "APPSTATS_INGEST_CHUNK_SIZE", 1000)
+    saved = 0
+    try:
+        for data in read_chunks(open_body(request), kind, chunk_size):
+            if spool is not None:
+                spool.append(app.pk, data)
+            else:
+                app.ingest(data)
+            saved += sum(len(data[key]) for key in KINDS[kind])
+    except UnsupportedEncoding as err:
+        return JsonResponse({"error": str(err)}, status=415)
+    except BodyTooLarge as err:
+        return JsonResponse({"error": str(err), "saved": saved}, status=413)
+    except (ValueError, EOFError, OSError, zlib.error) as err:
+        return JsonResponse({"error": f"Invalid NDJSON body: {err}", "saved": saved}, status=400)
+    except ValidationError as err:
+        return JsonResponse({"error": f"JSON does not match schema: {err.message}", "saved": saved}, status=400)
+
+    if spool is not None:
+        return JsonResponse({"success": "Metrics queued.", "saved": saved}, status=202)
+    return JsonResponse({"success": "Metrics saved.", "saved": saved})
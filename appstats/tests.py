@@ -1,3 +1,962 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import io
+import json
+import tempfile
+import threading
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .activity import LastSeenTracker
+from .archive import Archive
+from .cache import AppCache, aggregate_computed, app_cache, device_cache, navigation_cache, shared_cache
+from .checks import check_shared_cache
+from .middleware import AggregateStatsMiddleware
+from .models import (
+    App, Counter, CounterInstance, Event, EventInstance, EventRollup, GaugeInstance, Install, InstalledVersion, day_range, update_rollups,
+)
+from .spool import Spool, get_spool
+from .validation import VALIDATORS, ValidationError, is_well_formed, validate_payload
+
+
+def setUpModule():
+    # File-based caches would otherwise be the project's own, which
+    # clear_caches() wipes.
+    directory = tempfile.TemporaryDirectory()
+    test_caches = override_settings(CACHES={
+        alias: {**config, "LOCATION": f"{directory.name}/{alias}"}
+        if issubclass(import_string(config["BACKEND"]), FileBasedCache) else config
+        for alias, config in settings.CACHES.items()
+    })
+    test_caches.enable()
+    unittest.addModuleCleanup(directory.cleanup)
+    unittest.addModuleCleanup(test_caches.disable)
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+def make_device(model="iPhone10,1", os_version="16.0", device_id=None):
+    return {
+        "device_id": device_id or f"{model}-{os_version}",
+        "model": model,
+        "app_version": "1.0",
+        "build_number": os_version,
+        "os_name": "iOS",
+        "os_version": os_version,
+        "os_version_string": f"iOS {os_version}",
+    }
+
+
+class AppTestCase(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.app = App.objects.create(name="Test", slug="test", key="key")
+
+    def device(self, model, os_version):
+        return make_device(model, os_version)
+
+    def register(self, models):
+        now = timezone.now()
+        for model in models:
+            for os_version in ("15.0", "16.0"):
+                device = self.device(model, os_version)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.app.register_counter("launches", 1, now, now, **device)
+                    self.app.register_gauge("launch_time", 0.5, now, **device)
+                    self.app.register_event("opened", {}, now, **device)
+
+
+class DashboardQueryCountTests(AppTestCase):
+
+    def count_queries(self, url):
+        navigation_cache.invalidate()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assertQueriesIndependentOfDimensions(self, url):
+        self.register(["iPhone10,1", "iPhone11,2"])
+        queries = self.count_queries(url)
+        self.register([f"iPhone14,{i}" for i in range(30)])
+        self.assertEqual(self.count_queries(url), queries)
+
+    def test_counter_page(self):
+        self.assertQueriesIndependentOfDimensions("/app/test/counter/launches/")
+
+    def test_gauge_page(self):
+        self.assertQueriesIndependentOfDimensions("/app/test/gauge/launch_time/")
+
+    def test_event_page(self):
+        self.assertQueriesIndependentOfDimensions("/app/test/event/opened/")
+
+    def test_app_home_page(self):
+        self.register(["iPhone10,1"])
+        queries = self.count_queries("/app/test/")
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(20):
+                self.app.register_event(f"event{i}", {}, now, **self.device("iPhone10,1", "16.0"))
+        self.assertEqual(self.count_queries("/app/test/"), queries)
+
+    def test_breakdowns(self):
+        self.register(["iPhone10,1", "iPhone11,2"])
+        counter = self.app.counters.get()
+        self.assertEqual(counter.active_count_per_model(), {"iPhone10,1": 2, "iPhone11,2": 2})
+        self.assertEqual(counter.active_count_per_os_version(), {("iOS", "15.0"): 2, ("iOS", "16.0"): 2})
+        self.assertEqual(self.app.gauges.get().active_count_per_app_version(), {("1.0", "15.0"): 2, ("1.0", "16.0"): 2})
+
+    def test_aggregates_cached_until_ingest(self):
+        self.register(["iPhone10,1"])
+        counter = self.app.counters.get()
+        self.assertEqual(counter.total(), 2)
+        self.assertEqual(self.app.active_count_per_model(), {"iPhone10,1": 2})
+        with self.assertNumQueries(0):
+            self.assertEqual(counter.total(), 2)
+            self.assertEqual(self.app.active_count_per_model(), {"iPhone10,1": 2})
+        self.register(["iPhone11,2"])
+        self.assertEqual(counter.total(), 4)
+
+    def test_pages_compute_each_aggregate_once(self):
+        self.register(["iPhone10,1", "iPhone11,2"])
+        computed = []
+
+        def record(sender, instance, method, args, **kwargs):
+            computed.append((sender, instance.pk, method, args))
+
+        aggregate_computed.connect(record)
+        self.addCleanup(aggregate_computed.disconnect, record)
+        for url in ("/app/test/", "/app/test/counter/launches/", "/app/test/gauge/launch_time/", "/app/test/event/opened/"):
+            computed.clear()
+            response = self.client.get(url)
+            self.assertEqual(len(computed), len(set(computed)))
+            self.assertEqual(response["X-AppStats-Aggregates"], f"computed={len(computed)}, cached=0, memoized=0")
+
+    async def test_async_requests_compute_each_aggregate_once(self):
+        async def get_response(request):
+            pass
+
+        self.assertTrue(iscoroutinefunction(AggregateStatsMiddleware(get_response)))
+        await sync_to_async(self.register)(["iPhone10,1", "iPhone11,2"])
+        computed = []
+
+        def record(sender, instance, method, args, **kwargs):
+            computed.append((sender, instance.pk, method, args))
+
+        aggregate_computed.connect(record)
+        self.addCleanup(aggregate_computed.disconnect, record)
+        response = await self.async_client.get("/app/test/counter/launches/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(computed)
+        self.assertEqual(len(computed), len(set(computed)))
+        self.assertEqual(response["X-AppStats-Aggregates"], f"computed={len(computed)}, cached=0, memoized=0")
+
+
+class SeriesTests(AppTestCase):
+
+    def test_series(self):
+        self.register(["iPhone10,1", "iPhone11,2"])
+        now = timezone.now()
+        start = int(now.timestamp()) // 3600 * 3600
+        response = self.client.get("/app/test/gauge/launch_time/series/", {"start": start, "end": start + 3600, "interval": "minute", "max_points": 6})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["interval"], 600)
+        self.assertEqual(sum(x["value"] for x in data["points"]), 4)
+        self.assertEqual(data["points"][0]["mean"], 0.5)
+
+        response = self.client.get("/app/test/event/opened/series/", {"start": start, "end": start + 3600, "interval": "hour", "model": "iPhone10,1"})
+        self.assertEqual([x["value"] for x in response.json()["points"]], [2])
+        response = self.client.get("/app/test/counter/launches/series/", {"interval": "hour"})
+        self.assertEqual(response.status_code, 400)
+        for end in ("100000000000000000000", "-100000000000000000000", "1e3"):
+            response = self.client.get("/app/test/event/opened/series/", {"end": end})
+            self.assertEqual(response.status_code, 400)
+
+    def test_series_ranges_are_half_open(self):
+        noon = datetime.datetime(2022, 10, 17, 12, tzinfo=datetime.timezone.utc)
+        self.assertEqual(day_range(noon, noon + datetime.timedelta(hours=12)), (noon.date(), datetime.date(2022, 10, 18)))
+        self.assertEqual(day_range(noon, noon + datetime.timedelta(hours=13)), (noon.date(), datetime.date(2022, 10, 19)))
+        self.register(["iPhone10,1"])
+        midnight = int(timezone.now().timestamp()) // 86400 * 86400
+        for kind, name in (("counter", "launches"), ("gauge", "launch_time"), ("event", "opened")):
+            response = self.client.get(f"/app/test/{kind}/{name}/series/", {"start": midnight - 86400, "end": midnight, "interval": "day"})
+            self.assertEqual((response.json()["points"], response.json()["unique_devices"]), ([], 0))
+            response = self.client.get(f"/app/test/{kind}/{name}/series/", {"start": midnight, "end": midnight + 86400, "interval": "day"})
+            self.assertEqual((len(response.json()["points"]), response.json()["unique_devices"]), (1, 2))
+
+    def test_series_buckets_are_rounded_up_to_a_coarser_interval(self):
+        self.register(["iPhone10,1"])
+        end = int(timezone.now().timestamp()) // 3600 * 3600 + 3600
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/app/test/gauge/launch_time/series/", {"start": end - 30 * 86400, "end": end, "interval": "minute", "max_points": 500})
+        self.assertEqual(response.json()["interval"], 7200)
+        self.assertEqual(sum(x["value"] for x in response.json()["points"]), 2)
+        self.assertTrue(any("'hour'" in x["sql"] for x in context.captured_queries))
+
+
+class GaugeDistributionTests(AppTestCase):
+
+    def test_gauge_distribution(self):
+        now = timezone.now()
+        device = self.device("iPhone10,1", "16.0")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app.register_gauges([{"name": "launch_time", "value": i / 10, "date_created": now} for i in range(1, 101)], **device)
+        distribution = self.app.gauges.get().active_distribution()
+        self.assertAlmostEqual(distribution["percentiles"]["p50"], 5.0, delta=0.1)
+        self.assertAlmostEqual(distribution["percentiles"]["p99"], 9.9, delta=0.2)
+        self.assertEqual(sum(count for low, high, count in distribution["histogram"]), 100)
+
+
+class UniqueDevicesTests(AppTestCase):
+
+    def test_unique_devices(self):
+        self.register(["iPhone10,1", "iPhone11,2"])
+        self.register(["iPhone10,1"])
+        event = self.app.events.get()
+        self.assertEqual(event.total(), 6)
+        self.assertEqual(event.active_unique_devices(), 4)
+        self.assertEqual(event.unique_devices(model="iPhone11,2"), 2)
+        self.assertEqual(event.unique_devices(end=timezone.localdate()), 0)
+        self.assertEqual(event.unique_devices(start=timezone.localdate(), end=timezone.localdate() + datetime.timedelta(days=1)), 4)
+
+
+class NavigationCacheTests(AppTestCase):
+
+    def test_navigation_cached_until_app_changes(self):
+        self.register(["iPhone10,1"])
+        navigation_cache.invalidate()
+        with self.assertNumQueries(2):
+            self.assertEqual([(x.name, x.active_install_count) for x in navigation_cache.apps()], [("Test", 2)])
+        with self.assertNumQueries(0):
+            navigation_cache.apps()
+        App.objects.create(name="Another", slug="another", key="key")
+        self.assertEqual([x.name for x in navigation_cache.apps()], ["Another", "Test"])
+
+
+class RetentionTests(AppTestCase):
+
+    def test_apply_retention(self):
+        device = self.device("iPhone10,1", "16.0")
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app.register_events([
+                {"name": "opened", "attributes": {}, "date_created": now - datetime.timedelta(days=days)}
+                for days in (0, 10, 40, 100)
+            ], **device)
+        self.app.event_retention_days = 30
+        self.app.save()
+        call_command("apply_retention", batch_size=1, stdout=io.StringIO())
+        event = self.app.events.get()
+        self.assertEqual(event.instances.count(), 2)
+        self.assertEqual(event.rollups.aggregate(total=Sum("total"))["total"], 4)
+
+        call_command("rebuild_rollups", stdout=io.StringIO())
+        self.assertEqual(event.rollups.aggregate(total=Sum("total"))["total"], 4)
+        self.assertEqual(event.unique_devices(), 1)
+        self.assertEqual(event.unique_devices(end=timezone.localdate() - datetime.timedelta(days=30)), 1)
+
+    def test_apply_retention_to_gauge_summaries(self):
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app.register_gauges([
+                {"name": "launch_time", "value": 1.0, "date_created": now - datetime.timedelta(days=days)}
+                for days in (0, 10, 100)
+            ], **make_device())
+        call_command("compact_gauges", stdout=io.StringIO())
+        gauge = self.app.gauges.get()
+        self.assertEqual(gauge.summaries.count(), 2)
+
+        self.app.gauge_retention_days = 30
+        self.app.save()
+        call_command("apply_retention", stdout=io.StringIO())
+        self.assertEqual(gauge.instances.count(), 1)
+        self.assertEqual(list(gauge.summaries.values_list("count", flat=True)), [1])
+        self.assertEqual(gauge.rollups.aggregate(total=Sum("total"))["total"], 3)
+
+
+class GaugeCompactionTests(AppTestCase):
+
+    def test_compact_gauges(self):
+        device = self.device("iPhone10,1", "16.0")
+        start = (timezone.now() - datetime.timedelta(days=10)).replace(minute=0, second=0, microsecond=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app.register_gauges([
+                {"name": "launch_time", "value": value, "date_created": start + datetime.timedelta(minutes=minutes)}
+                for value, minutes in ((1.0, 5), (2.0, 10), (6.0, 70))
+            ], **device)
+        call_command("compact_gauges", batch_size=2, stdout=io.StringIO())
+        gauge = self.app.gauges.get()
+        self.assertEqual(gauge.instances.count(), 0)
+        self.assertEqual(sorted(gauge.summaries.values_list("count", "sum", "min", "max")), [(1, 6.0, 6.0, 6.0), (2, 3.0, 1.0, 2.0)])
+
+        response = self.client.get("/app/test/gauge/launch_time/series/", {
+            "start": int(start.timestamp()),
+            "end": int((start + datetime.timedelta(hours=2)).timestamp()),
+            "interval": "hour",
+        })
+        points = response.json()["points"]
+        self.assertEqual([(x["value"], x["mean"], x["max"]) for x in points], [(2, 1.5, 2.0), (1, 6.0, 6.0)])
+
+
+class ArchiveExportTests(AppTestCase):
+
+    def test_export_archive(self):
+        self.register(["iPhone10,1", "iPhone11,2"])
+        with tempfile.TemporaryDirectory() as path:
+            call_command("export_archive", path, stdout=io.StringIO())
+            partitions = list(Archive(path).partitions(app="test", kind="events"))
+            self.assertEqual([(x.metric, x.rows) for x in partitions], [("opened", 4)])
+            with partitions[0] as partition:
+                self.assertEqual(sorted(set(partition.column("model"))), ["iPhone10,1", "iPhone11,2"])
+                self.assertEqual(partition.column("attributes"), [{}] * 4)
+
+    def test_export_archive_of_compacted_gauges(self):
+        old = timezone.now() - datetime.timedelta(days=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app.register_gauges([
+                {"name": "launch_time", "value": value, "date_created": date}
+                for value, date in ((1.0, old), (2.0, old), (3.0, timezone.now()))
+            ], **make_device())
+        call_command("compact_gauges", stdout=io.StringIO())
+        with tempfile.TemporaryDirectory() as path:
+            call_command("export_archive", path, stdout=io.StringIO())
+            archive = Archive(path)
+            self.assertEqual(sum(x.rows for x in archive.partitions(kind="gauges")), 1)
+            [partition] = archive.partitions(kind="gauge_summaries")
+            with partition:
+                self.assertEqual(list(partition.column("count")), [2])
+                self.assertEqual(list(partition.column("sum")), [3.0])
+                self.assertEqual(partition.column("device_id"), [make_device()["device_id"]])
+                self.assertEqual(sum(count for sign, index, count in partition.column("sketch")[0]), 2)
+
+
+class ExportEndpointTests(AppTestCase):
+
+    def test_export(self):
+        self.register(["iPhone10,1", "iPhone11,2"])
+        url = "/app/test/gauge/launch_time/export/"
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {"key": "key", "format": "ndjson"})
+            rows = [json.loads(x) for x in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({x["model"] for x in rows}, {"iPhone10,1", "iPhone11,2"})
+        self.assertEqual(rows[0]["value"], 0.5)
+        self.assertLessEqual(len(context), 4)
+
+        response = self.client.get("/app/test/event/opened/export/", {"key": "key"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "date_created,attributes,device_id,model,os_name,os_version,app_version,build_number")
+        self.assertEqual(len(lines), 5)
+        for end in ("100000000000000000000", "-100000000000000000000", "1e3"):
+            response = self.client.get("/app/test/event/opened/export/", {"key": "key", "end": end})
+            self.assertEqual(response.status_code, 400)
+
+    def test_export_gauge_summaries(self):
+        self.register(["iPhone10,1"])
+        GaugeInstance.objects.update(date_created=timezone.now() - datetime.timedelta(days=10))
+        call_command("compact_gauges", stdout=io.StringIO())
+        url = "/app/test/gauge/launch_time/export/"
+        self.assertEqual(b"".join(self.client.get(url, {"key": "key"}).streaming_content).decode().count("\n"), 1)
+
+        response = self.client.get(url, {"key": "key", "rows": "summaries", "format": "ndjson"})
+        self.assertIn("launch_time-summaries.ndjson", response["Content-Disposition"])
+        rows = [json.loads(x) for x in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted((x["device_id"], x["count"], x["sum"]) for x in rows), [
+            ("iPhone10,1-15.0", 1, 0.5), ("iPhone10,1-16.0", 1, 0.5),
+        ])
+        self.assertEqual(self.client.get("/app/test/event/opened/export/", {"key": "key", "rows": "summaries"}).status_code, 400)
+
+
+class BenchmarkQueriesTests(AppTestCase):
+
+    def test_scratch_database_leaves_the_default_one_alone(self):
+        self.register(["iPhone10,1"])
+        InstalledVersion.objects.update(last_seen=timezone.now() - datetime.timedelta(days=3))
+        before = list(InstalledVersion.objects.values().order_by("pk")), list(CounterInstance.objects.values().order_by("pk"))
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/benchmark.json"
+            call_command("benchmark_queries", installs=50, repeat=1, output=path, stdout=io.StringIO())
+            with open(path) as f:
+                results = json.load(f)
+        self.assertIn("active installs", results["queries"])
+        self.assertNotIn("benchmark", connections)
+        self.assertEqual(App.objects.get(), self.app)
+        after = list(InstalledVersion.objects.values().order_by("pk")), list(CounterInstance.objects.values().order_by("pk"))
+        self.assertEqual(after, before)
+
+
+class CounterIngestTests(AppTestCase):
+
+    def post(self, counters):
+        return self.client.post(
+            "/api/counters/Test/?key=key",
+            json.dumps({"counters": counters, "device": make_device()}),
+            content_type="application/json",
+        )
+
+    def counters(self, count):
+        return [
+            {"name": f"counter{i}", "count": i, "dateCreated": 1666000000, "dateUpdated": 1666000000}
+            for i in range(count)
+        ]
+
+    def test_duplicate_names_are_summed(self):
+        counters = self.counters(3) + [{"name": "counter1", "count": 5, "dateCreated": 1666000000, "dateUpdated": 1666000100}]
+        response = self.post(counters)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], {"counter0": 0, "counter1": 6, "counter2": 2})
+        self.assertEqual(CounterInstance.objects.get(counter__name="counter1").count, 6)
+
+    def test_queries_independent_of_batch_size(self):
+        self.post(self.counters(2))
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.counters(5))
+        with CaptureQueriesContext(connection) as large:
+            self.post(self.counters(50))
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(Counter.objects.filter(app=self.app).count(), 50)
+
+    def test_overlapping_uploads_add_up(self):
+        self.post([{"name": "launches", "count": 2, "dateCreated": 1666000000, "dateUpdated": 1666000100}])
+        self.post([{"name": "launches", "count": 3, "dateCreated": 1666000050, "dateUpdated": 1666000150}])
+        instance = CounterInstance.objects.get()
+        self.assertEqual(instance.count, 5)
+        self.assertEqual(instance.date_updated.timestamp(), 1666000150)
+
+    def test_date_updated_only_moves_forward(self):
+        self.post([{"name": "launches", "count": 1, "dateCreated": 1666000000, "dateUpdated": 1666000200}])
+        self.post([{"name": "launches", "count": 1, "dateCreated": 1666000000, "dateUpdated": 1666000100}])
+        instance = CounterInstance.objects.get()
+        self.assertEqual(instance.count, 2)
+        self.assertEqual(instance.date_updated.timestamp(), 1666000200)
+
+
+class ActiveInstallTests(AppTestCase):
+
+    def test_active_installs_follow_the_latest_version(self):
+        old = timezone.now() - datetime.timedelta(days=90)
+        for device_id in ("active", "stale"):
+            self.app.register_event("opened", {}, timezone.now(), **make_device(device_id=device_id))
+        # The install rows disagree with their latest versions; the versions win.
+        Install.objects.filter(device_id="active").update(date_updated=old)
+        InstalledVersion.objects.filter(install__device_id="stale").update(last_seen=old)
+
+        self.assertEqual(list(self.app.active_installs().values_list("device_id", flat=True)), ["active"])
+        self.assertEqual(self.app.active_install_count(), 1)
+        self.assertEqual(sum(self.app.active_count_per_model().values()), 1)
+        self.assertEqual([x.active_install_count for x in navigation_cache.apps()], [1])
+
+
+class RollupUpdateTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.version = self.app.register_event("opened", {}, timezone.now(), **make_device()).version
+
+    def test_more_keys_than_one_update_can_match(self):
+        events = Event.objects.bulk_create([Event(app=self.app, name=f"event{i}") for i in range(1100)])
+        today = timezone.localdate()
+        update_rollups(EventRollup, "event", self.version, {(x.pk, today): 2 for x in events})
+        update_rollups(EventRollup, "event", self.version, {(x.pk, today): 1 for x in events})
+        rollups = EventRollup.objects.filter(event__in=events)
+        self.assertEqual(rollups.count(), 1100)
+        self.assertEqual(set(rollups.values_list("total", flat=True)), {3})
+
+    def test_device_registers_of_a_large_upload(self):
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app.register_events([{"name": f"event{i}", "attributes": {}, "date_created": now} for i in range(1100)], **make_device())
+        self.assertEqual(EventRollup.objects.filter(event__name__startswith="event").count(), 1100)
+        self.assertEqual(self.app.events.get(name="event1099").unique_devices(), 1)
+
+    def test_sketch_bins_of_a_large_upload(self):
+        now = timezone.now()
+        gauges = [
+            {"name": "launch_time", "value": 1 + i / 10, "date_created": now - datetime.timedelta(days=day)}
+            for day in range(60)
+            for i in range(20)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.app.register_gauges(gauges, **make_device())
+        self.assertEqual(self.app.gauges.get().sketch().count, 1200)
+
+
+class MergeDuplicateCounterInstancesTests(TransactionTestCase):
+    migrate_from = [("appstats", "0011_spoolcheckpoint")]
+    migrate_to = [("appstats", "0012_counterinstance_unique")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicates_are_merged(self):
+        apps = self.migrate(self.migrate_from)
+        now = timezone.now()
+        app = apps.get_model("appstats", "App").objects.create(name="Test", slug="test", key="key")
+        install = apps.get_model("appstats", "Install").objects.create(app=app, device_id="device")
+        version = apps.get_model("appstats", "InstalledVersion").objects.create(
+            install=install, model="iPhone10,1", app_version="1.0", build_number="1",
+            os_name="iOS", os_version="16.0", os_version_string="iOS 16.0",
+        )
+        counter = apps.get_model("appstats", "Counter").objects.create(app=app, name="launches")
+        other = apps.get_model("appstats", "Counter").objects.create(app=app, name="other")
+        CounterInstance = apps.get_model("appstats", "CounterInstance")
+        for count, created, updated in [(2, 10, 20), (3, 5, 30), (4, 15, 25)]:
+            CounterInstance.objects.create(
+                counter=counter, install=install, version=version, count=count,
+                date_created=now + datetime.timedelta(seconds=created),
+                date_updated=now + datetime.timedelta(seconds=updated),
+            )
+        CounterInstance.objects.create(counter=other, install=install, version=version, count=1, date_created=now, date_updated=now)
+
+        apps = self.migrate(self.migrate_to)
+        CounterInstance = apps.get_model("appstats", "CounterInstance")
+        merged = CounterInstance.objects.get(counter__name="launches")
+        self.assertEqual(merged.count, 9)
+        self.assertEqual(merged.date_created, now + datetime.timedelta(seconds=5))
+        self.assertEqual(merged.date_updated, now + datetime.timedelta(seconds=30))
+        self.assertEqual(CounterInstance.objects.get(counter__name="other").count, 1)
+
+
+class DeviceCacheTests(AppTestCase):
+
+    def register_event(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.app.register_event("opened", {}, timezone.now(), **make_device())
+
+    def test_deleted_install_is_not_reused(self):
+        first = self.register_event()
+        first.install.delete()
+        second = self.register_event()
+        self.assertNotEqual(second.install_id, first.install_id)
+        self.assertTrue(Install.objects.filter(pk=second.install_id).exists())
+
+    def test_cascade_delete_does_not_query_per_version(self):
+        self.register_event()
+        for os_version in ("14.0", "15.0", "17.0"):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.app.register_event("opened", {}, timezone.now(), **make_device(os_version=os_version, device_id="iPhone10,1-16.0"))
+        install = Install.objects.get()
+        self.assertEqual(install.versions.count(), 4)
+        with CaptureQueriesContext(connection) as context:
+            install.delete()
+        self.assertFalse(any(x["sql"].startswith('SELECT "appstats_install"') for x in context.captured_queries))
+
+    def test_shared_entries_of_many_devices_are_kept(self):
+        fingerprint = ("iPhone10,1", "1.0", "1", "iOS", "16.0", "iOS 16.0")
+        for i in range(1000):
+            device_cache.set(self.app.pk, f"device{i}", fingerprint, i, i)
+        hits = sum(device_cache.get(self.app.pk, f"device{i}", fingerprint) is not None for i in range(1000))
+        self.assertEqual(hits, 1000)
+
+    def test_shared_cache_is_not_listed_on_every_write(self):
+        cache = shared_cache()
+        cache._next_cull = 0
+        with mock.patch.object(cache, "_list_cache_files", wraps=cache._list_cache_files) as list_files:
+            for i in range(20):
+                cache.set(f"key{i}", i)
+        self.assertEqual(list_files.call_count, 1)
+
+    def test_per_process_shared_cache_is_rejected(self):
+        self.assertEqual(check_shared_cache(None), [])
+        with override_settings(APPSTATS_CACHE="default", APPSTATS_AGGREGATE_CACHE="default"):
+            self.assertEqual([x.id for x in check_shared_cache(None)], ["appstats.E001", "appstats.W001"])
+        with override_settings(APPSTATS_AGGREGATE_CACHE="default"):
+            self.assertEqual([x.id for x in check_shared_cache(None)], ["appstats.W001"])
+
+
+class BatchIngestTests(AppTestCase):
+
+    def post(self, data, key="key"):
+        return self.client.post(f"/api/batch/Test/?key={key}", json.dumps(data), content_type="application/json")
+
+    def test_counters_gauges_and_events_in_one_request(self):
+        response = self.post({
+            "counters": [{"name": "launches", "count": 2, "dateCreated": 1666000000, "dateUpdated": 1666000000}],
+            "gauges": [{"name": "launch_time", "value": 0.5, "dateCreated": 1666000000}],
+            "events": [{"name": "opened", "attributes": {"from": "widget"}, "dateCreated": 1666000000}],
+            "device": make_device(),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], {
+            "counters": {"launches": 2},
+            "gauges": {"launch_time": 0.5},
+            "events": {"opened": {"from": "widget"}},
+        })
+        self.assertEqual(Install.objects.count(), 1)
+
+    def test_kinds_are_optional(self):
+        response = self.post({"events": [{"name": "opened", "dateCreated": 1666000000}], "device": make_device()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"]["counters"], {})
+
+    def test_invalid_payloads(self):
+        self.assertEqual(self.client.post("/api/batch/Test/?key=key", "{", content_type="application/json").status_code, 400)
+        self.assertEqual(self.post({"events": []}).status_code, 400)
+        self.assertEqual(self.post({"device": make_device()}, key="wrong").status_code, 401)
+        self.assertEqual(self.client.get("/api/batch/Test/?key=key").status_code, 405)
+
+    def test_non_finite_gauge_values(self):
+        gauge = '{"name": "launch_time", "value": %s, "dateCreated": 1666000000}'
+        for value in ("1e309", "-Infinity", "NaN", "1" + "0" * 400):
+            with self.subTest(value=value):
+                body = '{"gauges": [%s], "device": %s}' % (gauge % value, json.dumps(make_device()))
+                for path in ("/api/gauges/Test/?key=key", "/api/batch/Test/?key=key"):
+                    self.assertEqual(self.client.post(path, body, content_type="application/json").status_code, 400)
+        self.assertFalse(GaugeInstance.objects.exists())
+
+
+class StreamingIngestTests(AppTestCase):
+
+    def event(self, i=0):
+        return {"name": "opened", "attributes": {"i": i}, "dateCreated": 1666000000 + i}
+
+    def post(self, body, content_type="application/json", **headers):
+        return self.client.post("/api/events/Test/?key=key", body, content_type=content_type, headers=headers)
+
+    def ndjson(self, *lines):
+        return b"".join(json.dumps(line).encode() + b"\n" for line in lines)
+
+    def test_gzip_json(self):
+        body = gzip.compress(json.dumps({"events": [self.event()], "device": make_device()}).encode())
+        self.assertEqual(self.post(body, Content_Encoding="gzip").status_code, 200)
+        self.assertEqual(EventInstance.objects.count(), 1)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=None)
+    def test_gzip_json_without_a_size_limit(self):
+        body = gzip.compress(json.dumps({"events": [self.event()], "device": make_device()}).encode())
+        self.assertEqual(self.post(body, Content_Encoding="gzip").status_code, 200)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1000)
+    def test_gzip_json_too_large_once_decompressed(self):
+        body = gzip.compress(json.dumps({"events": [self.event(i) for i in range(100)], "device": make_device()}).encode())
+        self.assertLess(len(body), 1000)
+        self.assertEqual(self.post(body, Content_Encoding="gzip").status_code, 413)
+        self.assertEqual(EventInstance.objects.count(), 0)
+
+    def test_malformed_gzip_and_unsupported_encoding(self):
+        self.assertEqual(self.post(b"not gzip", Content_Encoding="gzip").status_code, 400)
+        body = self.ndjson({"device": make_device()}, {"events": [self.event()]})
+        self.assertEqual(self.post(body[:-10], "application/x-ndjson", Content_Encoding="gzip").status_code, 400)
+        self.assertEqual(self.post(b"{}", Content_Encoding="br").status_code, 415)
+        self.assertEqual(self.post(body, "application/x-ndjson", Content_Encoding="br").status_code, 415)
+        self.assertEqual(EventInstance.objects.count(), 0)
+
+    @override_settings(APPSTATS_INGEST_CHUNK_SIZE=2)
+    def test_ndjson_is_saved_in_chunks(self):
+        body = self.ndjson(
+            {"device": make_device()},
+            {"events": [self.event(0), self.event(1), self.event(2)]},
+            {"events": [self.event(3), self.event(4)]},
+        )
+        with mock.patch.object(App, "ingest", autospec=True, side_effect=App.ingest) as ingest:
+            response = self.post(gzip.compress(body), "application/x-ndjson", Content_Encoding="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["saved"], 5)
+        self.assertEqual([len(x.args[1]["events"]) for x in ingest.call_args_list], [2, 2, 1])
+        self.assertEqual(EventInstance.objects.count(), 5)
+
+    @override_settings(APPSTATS_INGEST_CHUNK_SIZE=2)
+    def test_ndjson_reports_what_was_saved_before_an_error(self):
+        body = self.ndjson(
+            {"device": make_device()},
+            {"events": [self.event(0), self.event(1), self.event(2)]},
+        ) + b"{not json\n"
+        response = self.post(body, "application/x-ndjson")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["saved"], 2)
+        self.assertEqual(EventInstance.objects.count(), 2)
+
+        response = self.post(self.ndjson({"device": make_device()}, {"events": [{"name": "opened"}]}), "application/x-ndjson")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["saved"], 0)
+        self.assertEqual(self.post(self.ndjson({"events": []}), "application/x-ndjson").status_code, 400)
+
+    @override_settings(APPSTATS_INGEST_CHUNK_SIZE=1, DATA_UPLOAD_MAX_MEMORY_SIZE=1000)
+    def test_ndjson_line_too_large(self):
+        body = self.ndjson(
+            {"device": make_device()},
+            {"events": [self.event()]},
+            {"events": [self.event(i) for i in range(100)]},
+        )
+        response = self.post(body, "application/x-ndjson")
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()["saved"], 1)
+        self.assertEqual(EventInstance.objects.count(), 1)
+
+
+class ValidationTests(SimpleTestCase):
+
+    def payloads(self):
+        counter = {"name": "launches", "count": 1, "dateCreated": 1666000000, "dateUpdated": 1666000000}
+        gauge = {"name": "launch_time", "value": 0.5, "dateCreated": 1666000000}
+        event = {"name": "opened", "attributes": {}, "dateCreated": 1666000000}
+        device = make_device()
+        yield "counters", {"counters": [counter], "device": device}
+        yield "counters", {"counters": [dict(counter, count=True)], "device": device}
+        yield "counters", {"counters": [dict(counter, dateCreated=1666000000.0)], "device": device}
+        yield "counters", {"counters": [dict(counter, dateUpdated=1666000000.5)], "device": device}
+        yield "counters", {"counters": [dict(counter, extra=1)], "device": dict(device, extra="x")}
+        yield "gauges", {"gauges": [dict(gauge, value=True)], "device": device}
+        yield "gauges", {"gauges": [dict(gauge, value=2)], "device": device}
+        yield "gauges", {"gauges": [dict(gauge, dateCreated=1666000000.0)], "device": device}
+        yield "gauges", {"gauges": [gauge], "device": device, "extra": []}
+        yield "events", {"events": [event], "device": device}
+        yield "events", {"events": [dict(event, attributes=None)], "device": device}
+        yield "events", {"events": [{"name": "opened", "dateCreated": 1666000000}], "device": device}
+        yield "events", {"events": [dict(event, attributes=[])], "device": device}
+        yield "events", {"events": [dict(event, dateCreated=True)], "device": device}
+        yield "batch", {"device": device}
+        yield "batch", {"counters": [dict(counter, count=True)], "events": [event], "device": device}
+        yield "batch", {"gauges": [gauge], "device": dict(device, model=None)}
+
+    def test_fast_path_only_accepts_what_the_schema_accepts(self):
+        for kind, data in self.payloads():
+            with self.subTest(kind=kind, data=data):
+                valid = VALIDATORS[kind].is_valid(data)
+                if is_well_formed(data, kind):
+                    self.assertTrue(valid)
+                try:
+                    validate_payload(data, kind)
+                except ValidationError:
+                    self.assertFalse(valid)
+                else:
+                    self.assertTrue(valid)
+
+    def test_non_finite_gauge_values_are_rejected(self):
+        gauge = {"name": "launch_time", "dateCreated": 1666000000}
+        for kind in ("gauges", "batch"):
+            for value in (float("inf"), float("-inf"), float("nan"), 10 ** 400):
+                data = {"gauges": [dict(gauge, value=value)], "device": make_device()}
+                with self.subTest(kind=kind, value=value):
+                    self.assertFalse(is_well_formed(data, kind))
+                    with self.assertRaises(ValidationError):
+                        validate_payload(data, kind)
+
+    def test_common_payloads_take_the_fast_path(self):
+        device = make_device()
+        self.assertTrue(is_well_formed({"counters": [{"name": "a", "count": 1, "dateCreated": 1, "dateUpdated": 1}], "device": device}, "counters"))
+        self.assertTrue(is_well_formed({"gauges": [{"name": "a", "value": 1, "dateCreated": 1}], "device": device}, "gauges"))
+        self.assertTrue(is_well_formed({"events": [{"name": "a", "dateCreated": 1}], "device": device}, "events"))
+        self.assertTrue(is_well_formed({"events": [{"name": "a", "attributes": None, "dateCreated": 1}], "device": device}, "batch"))
+
+
+class LastSeenTrackerTests(AppTestCase):
+
+    def test_flush_writes_the_install_and_its_latest_version(self):
+        old = timezone.now() - datetime.timedelta(days=90)
+        version = self.app.register_event("opened", {}, timezone.now(), **make_device()).version
+        Install.objects.update(date_updated=old)
+        InstalledVersion.objects.update(last_seen=old)
+
+        tracker = LastSeenTracker()
+        tracker.touch(version.install_id)
+        self.assertEqual(tracker.flush(), 1)
+        self.assertGreater(Install.objects.get().date_updated, old)
+        self.assertGreater(InstalledVersion.objects.get().last_seen, old)
+
+        # Touches within APPSTATS_LAST_SEEN_INTERVAL of the write are coalesced.
+        Install.objects.update(date_updated=old)
+        tracker.touch(version.install_id)
+        self.assertEqual(tracker.flush(), 0)
+        self.assertEqual(Install.objects.get().date_updated, old)
+
+    @override_settings(APPSTATS_LAST_SEEN_FLUSH_INTERVAL=0.01)
+    def test_pending_installs_are_flushed_without_further_requests(self):
+        tracker = LastSeenTracker()
+        flushed = threading.Event()
+        with mock.patch.object(tracker, "flush", side_effect=flushed.set):
+            tracker.touch(1)
+            self.assertTrue(flushed.wait(5))
+
+
+class AppAuthenticationTests(AppTestCase):
+
+    def post(self, app_name="Test", key="key"):
+        return self.client.post(
+            f"/api/events/{app_name}/?key={key}",
+            json.dumps({"events": [{"name": "opened", "dateCreated": 1666000000}], "device": make_device()}),
+            content_type="application/json",
+        )
+
+    def test_wrong_key_or_app(self):
+        self.assertEqual(self.post(key="wrong").status_code, 401)
+        self.assertEqual(self.post(app_name="Other").status_code, 401)
+        self.assertEqual(self.post().status_code, 200)
+
+    def test_cached_credentials(self):
+        self.post()
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(app_cache.authenticate("Test", "key"))
+            self.assertIsNone(app_cache.authenticate("Test", "wrong"))
+
+    def test_saving_an_app_invalidates_every_worker(self):
+        other_worker = AppCache()
+        self.assertEqual(self.post().status_code, 200)
+        self.assertIsNone(other_worker.authenticate("Other", "other"))
+        self.assertIsNotNone(other_worker.authenticate("Test", "key"))
+
+        self.app.key = "rotated"
+        self.app.save()
+        App.objects.create(name="Other", slug="other", key="other")
+        self.assertEqual(self.post().status_code, 401)
+        self.assertEqual(self.post(key="rotated").status_code, 200)
+        self.assertIsNone(other_worker.authenticate("Test", "key"))
+        self.assertIsNotNone(other_worker.authenticate("Other", "other"))
+
+    def test_async_authentication_stays_off_the_event_loop(self):
+        cache = shared_cache()
+
+        def off_loop(method):
+            def wrapper(*args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    return method(*args, **kwargs)
+                raise AssertionError(f"{method.__name__}() called on the event loop")
+            return wrapper
+
+        with mock.patch.object(cache, "get", off_loop(cache.get)), mock.patch.object(cache, "add", off_loop(cache.add)):
+            self.assertIsNotNone(async_to_sync(AppCache().aauthenticate)("Test", "key"))
+            self.assertIsNone(async_to_sync(AppCache().aauthenticate)("Test", "wrong"))
+
+
+class SpoolTests(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(APPSTATS_SPOOL_PATH=f"{directory.name}/spool.sqlite3")
+        settings.enable()
+        self.addCleanup(settings.disable)
+        get_spool.cache_clear()
+        self.addCleanup(get_spool.cache_clear)
+
+    def post(self, count):
+        now = int(timezone.now().timestamp())
+        return self.client.post(
+            "/api/counters/Test/?key=key",
+            json.dumps({
+                "counters": [{"name": "launches", "count": count, "dateCreated": now, "dateUpdated": now}],
+                "device": make_device(),
+            }),
+            content_type="application/json",
+        )
+
+    def drain(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("drain_spool", stdout=io.StringIO())
+
+    def test_payloads_are_written_exactly_once(self):
+        self.assertEqual(self.post(2).status_code, 202)
+        self.assertEqual(self.post(3).status_code, 202)
+        self.assertFalse(CounterInstance.objects.exists())
+
+        # Stop after the checkpoint is committed but before the spool is
+        # trimmed, as a crash there would.
+        with mock.patch.object(Spool, "delete_through"):
+            self.drain()
+        self.assertEqual(CounterInstance.objects.get().count, 5)
+        self.assertEqual(len(get_spool()), 2)
+
+        self.drain()
+        self.drain()
+        self.assertEqual(CounterInstance.objects.get().count, 5)
+        self.assertEqual(self.app.counters.get().total(), 5)
+        self.assertEqual(len(get_spool()), 0)
+
+
+@override_settings(ROOT_URLCONF="webapp.asgi_urls")
+class AsyncViewTests(AppTestCase):
+
+    def payload(self, **metrics):
+        return json.dumps({**metrics, "device": make_device()})
+
+    async def test_ingest(self):
+        now = int(timezone.now().timestamp())
+        response = await self.async_client.post(
+            "/api/counters/Test/?key=key",
+            self.payload(counters=[{"name": "launches", "count": 2, "dateCreated": now, "dateUpdated": now}]),
+            content_type="application/json",
+        )
+        self.assertEqual((response.status_code, response.json()["results"]), (200, {"launches": 2}))
+
+        response = await self.async_client.post(
+            "/api/events/Test/?key=key",
+            gzip.compress(self.payload(events=[{"name": "opened", "dateCreated": now}]).encode()),
+            content_type="application/json",
+            headers={"Content-Encoding": "gzip"},
+        )
+        self.assertEqual((response.status_code, response.json()["results"]), (200, {"opened": {}}))
+
+        body = json.dumps({"device": make_device()}) + "\n" + json.dumps({"gauges": [{"name": "launch_time", "value": 0.5, "dateCreated": now}]})
+        response = await self.async_client.post("/api/gauges/Test/?key=key", body, content_type="application/x-ndjson")
+        self.assertEqual((response.status_code, response.json()["saved"]), (200, 1))
+
+        response = await self.async_client.post("/api/batch/Test/?key=key", self.payload(), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await EventInstance.objects.acount(), 1)
+
+    async def test_ingest_errors(self):
+        self.assertEqual((await self.async_client.get("/api/events/Test/?key=key")).status_code, 405)
+        response = await self.async_client.post("/api/events/Test/?key=wrong", self.payload(events=[]), content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.post("/api/events/Test/?key=key", "{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    async def test_ingest_into_the_spool(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(APPSTATS_SPOOL_PATH=f"{directory}/spool.sqlite3"):
+            get_spool.cache_clear()
+            self.addCleanup(get_spool.cache_clear)
+            response = await self.async_client.post(
+                "/api/events/Test/?key=key",
+                self.payload(events=[{"name": "opened", "dateCreated": 1666000000}]),
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(await EventInstance.objects.acount(), 0)
+            self.assertEqual(len(get_spool()), 1)
+
+    async def test_dashboard_series_and_export(self):
+        await sync_to_async(self.register)(["iPhone10,1"])
+        for url in ("/", "/app/test/", "/app/test/counter/launches/", "/app/test/gauge/launch_time/", "/app/test/event/opened/"):
+            self.assertEqual((await self.async_client.get(url)).status_code, 200, url)
+        self.assertEqual((await self.async_client.get("/app/test/counter/missing/")).status_code, 404)
+
+        for url in ("/app/test/counter/launches/series/", "/app/test/gauge/launch_time/series/", "/app/test/event/opened/series/"):
+            response = await self.async_client.get(url, {"interval": "day"})
+            self.assertEqual(sum(x["value"] for x in response.json()["points"]), 2, url)
+
+        response = await self.async_client.get("/app/test/event/opened/export/", {"key": "key"})
+        self.assertTrue(response.streaming)
+        lines = b"".join([x async for x in response.streaming_content]).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        response = await self.async_client.get("/app/test/gauge/launch_time/export/")
+        self.assertEqual(response.status_code, 401)
@@ -7,10 +7,17 @@ urlpatterns = [
     path("api/counters/<slug:app_name>/", views.register_counters),
     path("api/gauges/<slug:app_name>/", views.register_gauges),
     path("api/events/<slug:app_name>/", views.register_events),
+    path("api/batch/<slug:app_name>/", views.register_batch),
 
     path("", views.home),
     path("app/<slug:app_slug>/", views.app_home, name="appstats.app_home"),
     path("app/<slug:app_slug>/counter/<str:counter_name>/", views.counter, name="appstats.counter"),
+    path("app/<slug:app_slug>/counter/<str:counter_name>/series/", views.counter_series, name="appstats.counter_series"),
+    path("app/<slug:app_slug>/counter/<str:counter_name>/export/", views.counter_export, name="appstats.counter_export"),
     path("app/<slug:app_slug>/gauge/<str:gauge_name>/", views.gauge, name="appstats.gauge"),
+    path("app/<slug:app_slug>/gauge/<str:gauge_name>/series/", views.gauge_series, name="appstats.gauge_series"),
+    path("app/<slug:app_slug>/gauge/<str:gauge_name>/export/", views.gauge_export, name="appstats.gauge_export"),
     path("app/<slug:app_slug>/event/<str:event_name>/", views.event, name="appstats.event"),
+    path("app/<slug:app_slug>/event/<str:event_name>/series/", views.event_series, name="appstats.event_series"),
+    path("app/<slug:app_slug>/event/<str:event_name>/export/", views.event_export, name="appstats.event_export"),
 ]
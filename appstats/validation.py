@@ -0,0 +1,113 @@
+import math
+
+from jsonschema import ValidationError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+from .models import DEVICE_SCHEMA, COUNTERS_SCHEMA, GAUGES_SCHEMA, EVENTS_SCHEMA, BATCH_SCHEMA
+
+
+def compile_schema(schema):
+    """Check a schema and build a reusable validator for it."""
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+VALIDATORS = {
+    "counters": compile_schema(COUNTERS_SCHEMA),
+    "gauges": compile_schema(GAUGES_SCHEMA),
+    "events": compile_schema(EVENTS_SCHEMA),
+    "batch": compile_schema(BATCH_SCHEMA),
+}
+
+# The metric lists each kind of payload may contain, and whether each is required.
+PAYLOAD_KEYS = {
+    "counters": {"counters": True},
+    "gauges": {"gauges": True},
+    "events": {"events": True},
+    "batch": {"counters": False, "gauges": False, "events": False},
+}
+
+
+def _is_finite(value):
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        # An int too large for a float.
+        return False
+
+
+def _is_device(device):
+    return type(device) is dict and all(type(device.get(key)) is str for key in DEVICE_SCHEMA["required"])
+
+
+def _is_counter(counter):
+    return (
+        type(counter) is dict
+        and type(counter.get("name")) is str
+        and type(counter.get("count")) is int
+        and type(counter.get("dateCreated")) is int
+        and type(counter.get("dateUpdated")) is int
+    )
+
+
+def _is_gauge(gauge):
+    return (
+        type(gauge) is dict
+        and type(gauge.get("name")) is str
+        and type(gauge.get("value")) in (int, float)
+        and _is_finite(gauge["value"])
+        and type(gauge.get("dateCreated")) is int
+    )
+
+
+def _is_event(event):
+    return (
+        type(event) is dict
+        and type(event.get("name")) is str
+        and type(event.get("attributes", None)) in (dict, type(None))
+        and type(event.get("dateCreated")) is int
+    )
+
+
+ITEM_CHECKS = {
+    "counters": _is_counter,
+    "gauges": _is_gauge,
+    "events": _is_event,
+}
+
+
+def is_well_formed(data, kind):
+    """Check the common, well-formed shape of a payload without jsonschema.
+
+    This only ever accepts payloads the schema accepts; anything unusual
+    (floats with integral values, missing keys, wrong types) returns False
+    and is left to the full validator.
+    """
+    if type(data) is not dict or not _is_device(data.get("device")):
+        return False
+    for key, required in PAYLOAD_KEYS[kind].items():
+        if key not in data:
+            if required:
+                return False
+            continue
+        items = data[key]
+        if type(items) is not list or not all(map(ITEM_CHECKS[key], items)):
+            return False
+    return True
+
+
+def validate_payload(data, kind):
+    """Validate an ingest payload, raising ValidationError if it does not match its schema."""
+    if is_well_formed(data, kind):
+        return
+    error = best_match(VALIDATORS[kind].iter_errors(data))
+    if error is not None:
+        raise error
+    # JSON numbers such as 1e309 parse as infinity, which the schema allows
+    # but a gauge reading cannot be stored or binned as.
+    if "gauges" in PAYLOAD_KEYS[kind]:
+        for gauge in data.get("gauges", ()):
+            if not _is_finite(gauge["value"]):
+                raise ValidationError(f"{gauge['value']!r} is not a finite number.")
@@ -1,26 +1,40 @@
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
-from django.utils.timezone import make_aware
+from django.utils import timezone
 
+import csv
+import datetime
+import io
 import json
-from datetime import datetime
+import zlib
 
-from jsonschema import validate, ValidationError
-
-from .models import App, COUNTERS_SCHEMA, GAUGES_SCHEMA, EVENTS_SCHEMA
+from .cache import app_cache
+from .models import App, ROLLUP_DIMENSIONS, day_range, from_timestamp
+from .spool import get_spool
+from .streaming import BodyTooLarge, UnsupportedEncoding, ingest_ndjson, is_ndjson, read_body
+from .validation import validate_payload, ValidationError
 
 
 def home(request):
     return render(request, "appstats/home.html", {})
 
 
+def app_home_context(app):
+    totals = app.metric_totals()
+    return {
+        "app": app,
+        "counters": [(x, totals["counters"].get(x.pk, 0)) for x in app.counters.all()],
+        "gauges": [(x, totals["gauges"].get(x.pk, 0)) for x in app.gauges.all()],
+        "events": [(x, totals["events"].get(x.pk, 0)) for x in app.events.all()],
+    }
+
+
 def app_home(request, app_slug):
     app = get_object_or_404(App, slug=app_slug)
-    return render(request, "appstats/app_home.html", {
-        "app": app,
-    })
+    return render(request, "appstats/app_home.html", app_home_context(app))
 
 
 def counter(request, app_slug, counter_name):
@@ -50,107 +64,215 @@ def event(request, app_slug, event_name):
     })
 
 
-@require_POST
-@csrf_exempt
-def register_counters(request, app_name):
-    """Register a counter update."""
-
+def series_response(request, metric):
+    """Return a JSON time series for a metric, as described by the query string."""
     try:
-        data = json.loads(request.body)
-    except ValueError:
-        return JsonResponse({"error": "Invalid JSON body."}, status=400)
+        end = from_timestamp(int(request.GET["end"])) if "end" in request.GET else timezone.now()
+        start = from_timestamp(int(request.GET["start"])) if "start" in request.GET else end - datetime.timedelta(days=7)
+        max_points = int(request.GET.get("max_points", 500))
+    except (ValueError, OverflowError, OSError):
+        return JsonResponse({"error": "start, end and max_points must be integers in range."}, status=400)
+    interval = request.GET.get("interval", metric.series_intervals[0] if len(metric.series_intervals) == 1 else "hour")
+    if interval not in metric.series_intervals:
+        return JsonResponse({"error": f"interval must be one of: {', '.join(metric.series_intervals)}."}, status=400)
+    if end <= start or max_points < 1:
+        return JsonResponse({"error": "The range must not be empty and max_points must be positive."}, status=400)
+
+    filters = {x: request.GET[x] for x in ROLLUP_DIMENSIONS if x in request.GET}
+    width, points = metric.series(start, end, interval, max_points, **filters)
+    return JsonResponse({
+        "name": metric.name,
+        "start": int(start.timestamp()),
+        "end": int(end.timestamp()),
+        "interval": width,
+        "filters": filters,
+        "unique_devices": metric.unique_devices(*day_range(start, end), **filters),
+        "points": points,
+    })
 
-    try:
-        validate(instance=data, schema=COUNTERS_SCHEMA)
-    except ValidationError as err:
-        return JsonResponse({"error": f"JSON does not match schema: {err.message}"}, status=400)
 
-    try:
-        app = App.objects.get(name=app_name, key=request.GET.get("key"))
-    except App.DoesNotExist:
+def counter_series(request, app_slug, counter_name):
+    app = get_object_or_404(App, slug=app_slug)
+    return series_response(request, get_object_or_404(app.counters, name=counter_name))
+
+
+def gauge_series(request, app_slug, gauge_name):
+    app = get_object_or_404(App, slug=app_slug)
+    return series_response(request, get_object_or_404(app.gauges, name=gauge_name))
+
+
+def event_series(request, app_slug, event_name):
+    app = get_object_or_404(App, slug=app_slug)
+    return series_response(request, get_object_or_404(app.events, name=event_name))
+
+
+def _csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _csv_lines(fields, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_csv_value(x) for x in row])
+        if i % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_lines(fields, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder))
+        if len(lines) == 1000:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", _csv_lines),
+    "ndjson": ("application/x-ndjson", _ndjson_lines),
+}
+
+
+def export_response(request, app, metric):
+    """Stream a metric's raw instances as CSV or NDJSON, as described by the query string.
+
+    For gauges, rows=summaries exports the readings that compact_gauges has
+    compacted instead. Exports need the app's key, or a staff login.
+    """
+    if not request.user.is_staff and app_cache.authenticate(app.name, request.GET.get("key")) is None:
         return JsonResponse({"error": "Invalid app and key."}, status=401)
+    export_format = request.GET.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}."}, status=400)
+    try:
+        start = from_timestamp(int(request.GET["start"])) if "start" in request.GET else None
+        end = from_timestamp(int(request.GET["end"])) if "end" in request.GET else None
+    except (ValueError, OverflowError, OSError):
+        return JsonResponse({"error": "start and end must be integers in range."}, status=400)
+    sources = {"instances": (metric.export_fields, metric.export_rows, "")}
+    if hasattr(metric, "export_summary_rows"):
+        sources["summaries"] = (metric.summary_export_fields, metric.export_summary_rows, "-summaries")
+    source = request.GET.get("rows", "instances")
+    if source not in sources:
+        return JsonResponse({"error": f"rows must be one of: {', '.join(sources)}."}, status=400)
+
+    content_type, lines = EXPORT_FORMATS[export_format]
+    fields, export_rows, suffix = sources[source]
+    response = StreamingHttpResponse(lines(fields, export_rows(start, end)), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{app.slug}-{metric.name}{suffix}.{export_format}"'
+    return response
+
+
+def counter_export(request, app_slug, counter_name):
+    app = get_object_or_404(App, slug=app_slug)
+    return export_response(request, app, get_object_or_404(app.counters, name=counter_name))
 
-    results = []
-    for counter in data["counters"]:
-        results.append(app.register_counter(
-            name=counter["name"],
-            count=counter["count"],
-            date_created=make_aware(datetime.fromtimestamp(counter["dateCreated"])),
-            date_updated=make_aware(datetime.fromtimestamp(counter["dateUpdated"])),
-            **data["device"],
-        ))
 
-    return JsonResponse({
-        "success": "Counters updated.",
-        "results": dict((x.counter.name, x.count) for x in results),
-    })
+def gauge_export(request, app_slug, gauge_name):
+    app = get_object_or_404(App, slug=app_slug)
+    return export_response(request, app, get_object_or_404(app.gauges, name=gauge_name))
 
 
-@require_POST
-@csrf_exempt
-def register_gauges(request, app_name):
-    """Register a Gauge value."""
+def event_export(request, app_slug, event_name):
+    app = get_object_or_404(App, slug=app_slug)
+    return export_response(request, app, get_object_or_404(app.events, name=event_name))
 
+
+def counter_results(results):
+    return dict((x.counter.name, x.count) for x in results["counters"])
+
+
+def gauge_results(results):
+    return dict((x.gauge.name, x.value) for x in results["gauges"])
+
+
+def event_results(results):
+    return dict((x.event.name, x.attributes) for x in results["events"])
+
+
+def batch_results(results):
+    return {
+        "counters": counter_results(results),
+        "gauges": gauge_results(results),
+        "events": event_results(results),
+    }
+
+
+def read_payload(request, kind):
+    """Read and validate a regular JSON upload, returning the data and an error response, one of them None."""
     try:
-        data = json.loads(request.body)
-    except ValueError:
-        return JsonResponse({"error": "Invalid JSON body."}, status=400)
+        data = json.loads(read_body(request))
+    except UnsupportedEncoding as err:
+        return None, JsonResponse({"error": str(err)}, status=415)
+    except BodyTooLarge as err:
+        return None, JsonResponse({"error": str(err)}, status=413)
+    except (ValueError, EOFError, OSError, zlib.error):
+        return None, JsonResponse({"error": "Invalid JSON body."}, status=400)
 
     try:
-        validate(instance=data, schema=GAUGES_SCHEMA)
+        validate_payload(data, kind)
     except ValidationError as err:
-        return JsonResponse({"error": f"JSON does not match schema: {err.message}"}, status=400)
+        return None, JsonResponse({"error": f"JSON does not match schema: {err.message}"}, status=400)
+    return data, None
 
-    try:
-        app = App.objects.get(name=app_name, key=request.GET.get("key"))
-    except App.DoesNotExist:
+
+def _register(request, app_name, kind, success, queued, format_results):
+    if is_ndjson(request):
+        return ingest_ndjson(request, app_name, kind)
+
+    data, error = read_payload(request, kind)
+    if error is not None:
+        return error
+
+    app = app_cache.authenticate(app_name, request.GET.get("key"))
+    if app is None:
         return JsonResponse({"error": "Invalid app and key."}, status=401)
 
-    results = []
-    for gauge in data["gauges"]:
-        results.append(app.register_gauge(
-            name=gauge["name"],
-            value=gauge["value"],
-            date_created=make_aware(datetime.fromtimestamp(gauge["dateCreated"])),
-            **data["device"],
-        ))
+    spool = get_spool()
+    if spool is not None:
+        spool.append(app.pk, data)
+        return JsonResponse({"success": queued}, status=202)
 
     return JsonResponse({
-        "success": "Gauges saved.",
-        "results": dict((x.gauge.name, x.value) for x in results),
+        "success": success,
+        "results": format_results(app.ingest(data)),
     })
 
 
 @require_POST
 @csrf_exempt
-def register_events(request, app_name):
+def register_counters(request, app_name):
     """Register a counter update."""
+    return _register(request, app_name, "counters", "Counters updated.", "Counters queued.", counter_results)
 
-    try:
-        data = json.loads(request.body)
-    except ValueError:
-        return JsonResponse({"error": "Invalid JSON body."}, status=400)
 
-    try:
-        validate(instance=data, schema=EVENTS_SCHEMA)
-    except ValidationError as err:
-        return JsonResponse({"error": f"JSON does not match schema: {err.message}"}, status=400)
+@require_POST
+@csrf_exempt
+def register_gauges(request, app_name):
+    """Register a Gauge value."""
+    return _register(request, app_name, "gauges", "Gauges saved.", "Gauges queued.", gauge_results)
 
-    try:
-        app = App.objects.get(name=app_name, key=request.GET.get("key"))
-    except App.DoesNotExist:
-        return JsonResponse({"error": "Invalid app and key."}, status=401)
 
-    results = []
-    for event in data["events"]:
-        results.append(app.register_event(
-            name=event["name"],
-            attributes=event.get("attributes", {}),
-            date_created=make_aware(datetime.fromtimestamp(event["dateCreated"])),
-            **data["device"],
-        ))
+@require_POST
+@csrf_exempt
+def register_events(request, app_name):
+    """Register a counter update."""
+    return _register(request, app_name, "events", "Events saved.", "Events queued.", event_results)
+
 
-    return JsonResponse({
-        "success": "Events saved.",
-        "results": dict((x.event.name, x.attributes) for x in results),
-    })
+@require_POST
+@csrf_exempt
+def register_batch(request, app_name):
+    """Register counters, gauges and events from one device in a single request."""
+    return _register(request, app_name, "batch", "Metrics saved.", "Metrics queued.", batch_results)
@@ -3,6 +3,18 @@ ASGI config for webapp project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This entry point defaults to the ASGI deployment profile in
+``webapp.settings_asgi``, which serves the async views from
+``appstats.async_views``. Request bodies are received by the event loop, so
+a single process can hold thousands of slow uploads open at once while only
+database writes and template rendering use a thread. Serve it with any ASGI
+server, for example::
+
+    uvicorn webapp.asgi:application --workers 4 --host 0.0.0.0 --port 8000
+
+``manage.py benchmark_concurrency`` compares this profile with the WSGI
+entry point (``webapp.wsgi``) under a given number of concurrent clients.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 """
@@ -11,6 +23,6 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webapp.settings")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webapp.settings_asgi")
 
 application = get_asgi_application()
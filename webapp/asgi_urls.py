@@ -0,0 +1,12 @@
+"""webapp URL Configuration for the ASGI deployment profile.
+
+Identical to webapp.urls, except that the appstats views are the async
+versions from appstats.async_views.
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path("", include("appstats.async_urls")),
+    path("admin/", admin.site.urls),
+]
@@ -49,6 +49,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "appstats.middleware.AggregateStatsMiddleware",
 ]
 
 ROOT_URLCONF = "webapp.urls"
@@ -73,6 +74,27 @@ TEMPLATES = [
 WSGI_APPLICATION = "webapp.wsgi.application"
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.1/ref/settings/#caches
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Shared by every worker process on this host; see APPSTATS_CACHE. It
+    # holds an entry per install seen in the last APPSTATS_DEVICE_CACHE_TIMEOUT
+    # seconds, so MAX_ENTRIES must exceed the number of active devices, or
+    # entries are culled at random and the device cache stops skipping writes.
+    "appstats": {
+        "BACKEND": "appstats.cache.SharedFileCache",
+        "LOCATION": BASE_DIR / "cache" / "appstats",
+        "OPTIONS": {
+            "MAX_ENTRIES": 1_000_000,
+        },
+    },
+}
+
+
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
@@ -124,3 +146,37 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# AppStats
+
+# Path to a SQLite file used to spool ingest payloads. When set, the ingest
+# endpoints queue payloads and return 202, and `manage.py drain_spool` writes
+# them to the database.
+APPSTATS_SPOOL_PATH = None
+
+# Name of the cache (in CACHES) that worker processes use to tell each other
+# about changes: deleted installs and versions (the device cache), saved or
+# deleted apps (the app key cache) and new ingests (the aggregate cache). It
+# must be shared by every process, so a LocMemCache is rejected by a system
+# check. Use a DatabaseCache, Redis or Memcached when the workers run on
+# more than one host.
+APPSTATS_CACHE = "appstats"
+
+# Name of the cache (in CACHES) used for dashboard aggregates, which are kept
+# until the next ingest for their app. It also holds the ingest watermarks. A
+# LocMemCache works, with a warning: each worker then only sees its own
+# ingests, so with several workers dashboards can lag new data by up to
+# APPSTATS_AGGREGATE_CACHE_TIMEOUT seconds.
+APPSTATS_AGGREGATE_CACHE = "appstats"
+
+# Standard error of the unique device counts on the metric pages. Lower
+# values store more HyperLogLog registers per metric and day; after changing
+# it, run `manage.py rebuild_rollups` to rebuild the stored registers.
+APPSTATS_UNIQUE_DEVICES_ERROR = 0.02
+
+# Days of raw gauge readings, compacted gauge summaries and events to keep for
+# apps without their own retention, enforced by `manage.py apply_retention`.
+# None keeps them forever. Dashboard totals come from the rollups, which are
+# not pruned.
+APPSTATS_RETENTION_DAYS = None
@@ -0,0 +1,10 @@
+"""
+Django settings for the ASGI deployment profile of the webapp project.
+
+Uses the same settings as webapp.settings, but routes requests to the async
+appstats views. See webapp/asgi.py for how to serve it.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+ROOT_URLCONF = "webapp.asgi_urls"